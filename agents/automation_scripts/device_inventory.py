@@ -11,13 +11,69 @@ import time
 import json
 import argparse
 import subprocess
+import functools
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
 # Add parent directory to path to import hub_control
 sys.path.append(str(Path(__file__).parent.parent))
 
-from hub_control import HubController, load_config, DeviceRecord
+from hub_control import HubController, load_config, DeviceRecord, parse_port_list, ALL_PORTS
+
+# Parsed lsusb results are shared between scripts run back-to-back
+LSUSB_CACHE_FILE = Path.home() / ".cache" / "usbflashhub" / "lsusb.json"
+LSUSB_CACHE_TTL = 5.0  # seconds
+
+# Bounded pool for the many tiny sysfs reads in the fallback scan
+SYSFS_USB_PATH = Path("/sys/bus/usb/devices")
+SYSFS_SCAN_WORKERS = 8
+
+# Scans of up to this many ports read mapped sysfs entries instead of lsusb
+TOPOLOGY_SCAN_MAX_PORTS = 8
+
+# Write buffer for inventory exports
+EXPORT_BUFSIZE = 64 * 1024
+
+# Enumeration wait after powering on ports
+ENUMERATION_TIMEOUT = 3.0  # seconds
+ENUMERATION_POLL = 0.1     # seconds
+ENUMERATION_SETTLE = 0.5   # seconds without new devices before giving up early
+
+# One pass over raw lsusb -v bytes; the matching group tells which line kind was hit
+LSUSB_PATTERN = re.compile(
+    rb'^Bus \d+ Device \d+: ID ([0-9a-fA-F]{4}):([0-9a-fA-F]{4})'
+    rb'|^[ \t]+idVendor[ \t]+0x([0-9a-fA-F]{4})[ \t]*(.*)$'
+    rb'|^[ \t]+idProduct[ \t]+0x([0-9a-fA-F]{4})[ \t]*(.*)$'
+    rb'|^[ \t]+iSerial[ \t]+\d+[ \t]+(\S.*)$',
+    re.MULTILINE
+)
+LSUSB_BUFSIZE = 64 * 1024
+
+# Scan results: port -> device dict (or None), how many were connected, and when
+Inventory = namedtuple('Inventory', ['ports', 'connected', 'scan_time'])
+
+# Known device type mappings
+KNOWN_DEVICE_TYPES = {
+    ('303a', '1001'): 'ESP32-S2',
+    ('303a', '0002'): 'ESP32-S2',
+    ('303a', '1000'): 'ESP32',
+    ('303a', '80d4'): 'ESP32-C3',
+    ('303a', '4001'): 'ESP32-S3',
+    ('0483', 'df11'): 'STM32-DFU',
+    ('0483', '5740'): 'STM32',
+    ('2341', '0043'): 'Arduino-Uno',
+    ('1a86', '7523'): 'CH340-Serial',
+    ('0403', '6001'): 'FTDI-Serial',
+}
+
+# Same table keyed on the packed (VID << 16) | PID integer
+DEVICE_TYPES_BY_ID = {
+    int(vid, 16) << 16 | int(pid, 16): device_type
+    for (vid, pid), device_type in KNOWN_DEVICE_TYPES.items()
+}
 
 
 def main():
@@ -29,12 +85,21 @@ def main():
     parser.add_argument("--power-level", default="high",
                        help="Power level for scanning (off/low/high)")
     parser.add_argument("--export", help="Export results to file (JSON/CSV)")
+    parser.add_argument("--pretty", action="store_true",
+                       help="Indent exported JSON for reading")
     parser.add_argument("--update-db", action="store_true",
                        help="Update device database")
     parser.add_argument("--config", default="../hub_config.yaml")
+    parser.add_argument("--unbuffered", action="store_true",
+                       help="Write progress output immediately (interactive use)")
 
     args = parser.parse_args()
 
+    # Block-buffer progress output; each phase flushes once when it completes.
+    # Captured or redirected stdout (e.g. a StringIO) has no reconfigure().
+    if not args.unbuffered and hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(line_buffering=False, write_through=False)
+
     # Load configuration
     config = load_config(args.config)
 
@@ -54,29 +119,34 @@ def main():
         # Power on ports if requested
         if args.power_on:
             print(f"🔌 Powering on ports ({args.power_level})...")
-            for port in target_ports:
-                hub.power_port(port, args.power_level)
-                time.sleep(0.2)
+            before = get_usb_device_paths()
+            hub.power_ports_batch([(port, args.power_level) for port in target_ports], 0.02)
 
             # Wait for devices to enumerate
             print("⏳ Waiting for device enumeration...")
-            time.sleep(3.0)
+            sys.stdout.flush()
+            new_count = wait_for_enumeration(before, len(target_ports))
+            print(f"   {new_count} new USB devices enumerated")
 
-        # Scan for devices
+        # Scan for devices, skipping cached results from before power-on
         print(f"\n📱 Scanning for devices...")
-        inventory = scan_devices(target_ports)
+        inventory = scan_devices(target_ports, use_cache=not args.power_on,
+                                 usb_topology=config.get('usb_topology'))
+        sys.stdout.flush()
 
         # Update database if requested
         if args.update_db:
             print(f"💾 Updating device database...")
-            update_device_database(hub, inventory)
+            update_device_database(hub, inventory.ports, inventory.scan_time)
+            sys.stdout.flush()
 
-        # Display results
-        display_inventory(inventory)
+        # Display results, sorting the ports once for display and export
+        port_items = sorted(inventory.ports.items())
+        display_inventory(port_items, inventory.connected)
 
         # Export results if requested
         if args.export:
-            export_inventory(inventory, args.export)
+            export_inventory(inventory, port_items, args.export, args.pretty)
 
         return 0
 
@@ -99,53 +169,71 @@ def get_target_ports(args, config):
         if group_config:
             return group_config['ports']
 
-    return list(range(1, 33))  # All ports
+    return ALL_PORTS  # All ports
 
 
-def scan_devices(ports):
+def scan_devices(ports, use_cache=True, usb_topology=None):
     """Scan USB devices and correlate with ports"""
     inventory = {}
+    connected_count = 0
+
+    # One timestamp for every device found in this scan
+    scan_time = datetime.now()
+    detected_time = scan_time.isoformat()
 
     print("🔍 Scanning USB devices...")
 
-    # Get current USB device list
-    usb_devices = get_usb_devices()
+    # Small scans of ports with a known sysfs location skip the full lsusb run
+    mapped_devices = None
+    if (usb_topology and len(ports) <= TOPOLOGY_SCAN_MAX_PORTS
+            and all(port in usb_topology for port in ports)):
+        mapped_devices = {port: parse_sysfs_device(SYSFS_USB_PATH / usb_topology[port])
+                          for port in ports}
+        print(f"   Read {len(ports)} mapped ports from sysfs")
+    else:
+        # Get current USB device list
+        usb_devices = get_usb_devices(use_cache)
 
-    print(f"   Found {len(usb_devices)} USB devices system-wide")
+        print(f"   Found {len(usb_devices)} USB devices system-wide")
 
     # For each port, try to identify connected device
     for port in ports:
         print(f"   Port {port:2d}: ", end="")
 
-        # In a real implementation, this would correlate USB topology
-        # with physical ports. For now, we'll simulate this process.
-        device = identify_device_on_port(port, usb_devices)
+        if mapped_devices is not None:
+            raw_device = mapped_devices[port]
+            device = describe_usb_device(raw_device, detected_time) if raw_device else None
+        else:
+            # Without a topology map we can only simulate the correlation
+            # between USB devices and physical ports.
+            device = identify_device_on_port(port, usb_devices, detected_time)
 
         if device:
             inventory[port] = device
+            connected_count += 1
             print(f"{device['device_type']} ({device['serial']})")
         else:
             inventory[port] = None
             print("No device detected")
 
-    return inventory
+    return Inventory(inventory, connected_count, scan_time)
 
 
-def get_usb_devices():
+def get_usb_devices(use_cache=True):
     """Get list of USB devices from system"""
+    if use_cache:
+        devices = load_cached_usb_devices()
+        if devices is not None:
+            return devices
+    else:
+        _cached_lsusb.cache_clear()
+
     devices = []
 
     try:
         # Use lsusb to get device list
-        result = subprocess.run(
-            ["lsusb", "-v"],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
-
-        if result.returncode == 0:
-            devices = parse_lsusb_output(result.stdout)
+        devices = _cached_lsusb(int(time.time() // LSUSB_CACHE_TTL))
+        save_cached_usb_devices(devices)
 
     except FileNotFoundError:
         print("   ⚠️  lsusb not found - using alternative method")
@@ -158,19 +246,91 @@ def get_usb_devices():
     return devices
 
 
+@functools.lru_cache(maxsize=1)
+def _cached_lsusb(ttl_bucket):
+    """Run and parse lsusb -v at most once per cache bucket"""
+    with subprocess.Popen(["lsusb", "-v"], stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL, bufsize=LSUSB_BUFSIZE) as proc:
+        try:
+            output, _ = proc.communicate(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            raise
+
+    if proc.returncode != 0:
+        return []
+
+    return parse_lsusb_output(output)
+
+
+def load_cached_usb_devices():
+    """Load parsed lsusb results written by a recent run, if still fresh"""
+    try:
+        if time.time() - LSUSB_CACHE_FILE.stat().st_mtime < LSUSB_CACHE_TTL:
+            with open(LSUSB_CACHE_FILE) as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+def save_cached_usb_devices(devices):
+    """Persist parsed lsusb results for sibling scripts"""
+    try:
+        LSUSB_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(LSUSB_CACHE_FILE, 'w') as f:
+            json.dump(devices, f)
+    except OSError:
+        pass
+
+
+def get_usb_device_paths():
+    """Snapshot the sysfs names of currently enumerated USB devices"""
+    try:
+        return {d.name for d in SYSFS_USB_PATH.glob("*-*") if (d / "idVendor").exists()}
+    except OSError:
+        return set()
+
+
+def wait_for_enumeration(before, expected):
+    """Wait until expected new USB devices appear, return how many did
+
+    Returns early once new devices have stopped appearing for a short settle
+    period, so empty ports don't cost the full timeout.
+    """
+    start = time.monotonic()
+    last_change = start
+    new_count = 0
+
+    while time.monotonic() - start < ENUMERATION_TIMEOUT:
+        time.sleep(ENUMERATION_POLL)
+
+        count = len(get_usb_device_paths() - before)
+        now = time.monotonic()
+        if count != new_count:
+            new_count = count
+            last_change = now
+
+        if new_count >= expected:
+            break
+        if new_count and now - last_change >= ENUMERATION_SETTLE:
+            break
+
+    return new_count
+
+
 def get_usb_devices_alternative():
     """Alternative method to get USB devices"""
     devices = []
 
     try:
         # Read from /sys/bus/usb/devices
-        usb_path = Path("/sys/bus/usb/devices")
-        if usb_path.exists():
-            for device_dir in usb_path.glob("*-*"):
-                if device_dir.is_dir():
-                    device_info = parse_sysfs_device(device_dir)
-                    if device_info:
-                        devices.append(device_info)
+        if SYSFS_USB_PATH.exists():
+            device_dirs = [d for d in SYSFS_USB_PATH.glob("*-*") if d.is_dir()]
+            with ThreadPoolExecutor(max_workers=SYSFS_SCAN_WORKERS) as executor:
+                results = executor.map(parse_sysfs_device, device_dirs)
+                devices = [info for info in results if info]
 
     except Exception as e:
         print(f"   ❌ Alternative USB scan error: {e}")
@@ -179,50 +339,32 @@ def get_usb_devices_alternative():
 
 
 def parse_lsusb_output(output):
-    """Parse lsusb -v output"""
+    """Parse raw lsusb -v output, decoding only the captured fields"""
     devices = []
-    current_device = {}
-
-    for line in output.split('\n'):
-        line = line.strip()
-
-        if line.startswith('Bus ') and 'Device ' in line:
-            # New device
-            if current_device:
-                devices.append(current_device)
-            current_device = {}
-
-            # Parse bus/device line: "Bus 001 Device 005: ID 303a:1001 Espressif ESP32-S2"
-            parts = line.split()
-            if len(parts) >= 6:
-                vid_pid = parts[5].split(':')
-                if len(vid_pid) == 2:
-                    current_device['vendor_id'] = vid_pid[0]
-                    current_device['product_id'] = vid_pid[1]
-
-        elif line.startswith('idVendor'):
-            # Extract vendor info
-            parts = line.split(None, 2)
-            if len(parts) >= 3:
-                current_device['vendor_id'] = parts[1]
-                current_device['manufacturer'] = parts[2]
-
-        elif line.startswith('idProduct'):
-            # Extract product info
-            parts = line.split(None, 2)
-            if len(parts) >= 3:
-                current_device['product_id'] = parts[1]
-                current_device['product_name'] = parts[2]
-
-        elif line.startswith('iSerial') and 'Serial' in line:
-            # Extract serial number
-            parts = line.split()
-            if len(parts) >= 3:
-                current_device['serial'] = ' '.join(parts[2:])
-
-    # Add last device
-    if current_device:
-        devices.append(current_device)
+    current_device = None
+
+    for match in LSUSB_PATTERN.finditer(output):
+        vid, pid, vendor_id, manufacturer, product_id, product_name, serial = (
+            group.decode('utf-8', 'replace') if group is not None else None
+            for group in match.groups()
+        )
+
+        if vid:
+            # New device: "Bus 001 Device 005: ID 303a:1001 Espressif ESP32-S2"
+            current_device = {'vendor_id': vid, 'product_id': pid}
+            devices.append(current_device)
+        elif current_device is None:
+            continue
+        elif vendor_id:
+            current_device['vendor_id'] = vendor_id
+            if manufacturer:
+                current_device['manufacturer'] = manufacturer
+        elif product_id:
+            current_device['product_id'] = product_id
+            if product_name:
+                current_device['product_name'] = product_name
+        elif serial:
+            current_device['serial'] = serial
 
     return devices
 
@@ -263,55 +405,49 @@ def parse_sysfs_device(device_dir):
     return None
 
 
-def identify_device_on_port(port, usb_devices):
+def identify_device_on_port(port, usb_devices, detected_time):
     """Identify device connected to specific port"""
     # This is a simplified implementation
     # In reality, would need USB topology mapping
 
-    # Known device type mappings
-    device_types = {
-        ('303a', '1001'): 'ESP32-S2',
-        ('303a', '0002'): 'ESP32-S2',
-        ('303a', '1000'): 'ESP32',
-        ('303a', '80d4'): 'ESP32-C3',
-        ('303a', '4001'): 'ESP32-S3',
-        ('0483', 'df11'): 'STM32-DFU',
-        ('0483', '5740'): 'STM32',
-        ('2341', '0043'): 'Arduino-Uno',
-        ('1a86', '7523'): 'CH340-Serial',
-        ('0403', '6001'): 'FTDI-Serial',
-    }
-
     # For simulation, just cycle through detected devices
     # Real implementation would map USB tree to physical ports
     if usb_devices and (port - 1) < len(usb_devices):
-        device = usb_devices[port - 1]
+        return describe_usb_device(usb_devices[port - 1], detected_time)
 
-        vendor_id = device.get('vendor_id', '').lower()
-        product_id = device.get('product_id', '').lower()
+    return None
 
-        device_type = device_types.get((vendor_id, product_id), 'Unknown')
 
-        return {
-            'vendor_id': vendor_id,
-            'product_id': product_id,
-            'device_type': device_type,
-            'serial': device.get('serial', 'Unknown'),
-            'manufacturer': device.get('manufacturer', 'Unknown'),
-            'product_name': device.get('product_name', 'Unknown'),
-            'detected_time': datetime.now().isoformat()
-        }
+def describe_usb_device(device, detected_time):
+    """Build an inventory entry from a parsed lsusb/sysfs device"""
+    vendor_id = device.get('vendor_id', '').lower()
+    product_id = device.get('product_id', '').lower()
 
-    return None
+    try:
+        device_key = int(vendor_id, 16) << 16 | int(product_id, 16)
+    except ValueError:
+        device_key = None
+
+    device_type = DEVICE_TYPES_BY_ID.get(device_key, 'Unknown')
+
+    return {
+        'vendor_id': vendor_id,
+        'product_id': product_id,
+        'device_type': device_type,
+        'serial': device.get('serial', 'Unknown'),
+        'manufacturer': device.get('manufacturer', 'Unknown'),
+        'product_name': device.get('product_name', 'Unknown'),
+        'detected_time': detected_time
+    }
 
 
-def update_device_database(hub, inventory):
+def update_device_database(hub, inventory, scan_time):
     """Update device database with inventory results"""
-    updated_count = 0
+    records = []
 
     for port, device_info in inventory.items():
         if device_info:
-            device_record = DeviceRecord(
+            records.append(DeviceRecord(
                 vendor_id=device_info['vendor_id'],
                 product_id=device_info['product_id'],
                 device_type=device_info['device_type'],
@@ -319,53 +455,61 @@ def update_device_database(hub, inventory):
                 manufacturer=device_info['manufacturer'],
                 product_name=device_info['product_name'],
                 port_number=port,
-                last_seen=datetime.now()
-            )
+                last_seen=scan_time
+            ))
+
+    updated_count = 0
 
+    try:
+        # Write every record in a single transaction
+        device_ids = hub.device_db.add_devices(records)
+        for device_id, record in zip(device_ids, records):
+            print(f"   Updated device {device_id} on port {record.port_number}")
+        updated_count = len(device_ids)
+
+    except Exception:
+        # Fall back to per-record writes so one bad record doesn't lose the rest
+        for record in records:
             try:
-                device_id = hub.device_db.add_device(device_record)
+                device_id = hub.device_db.add_device(record)
                 updated_count += 1
-                print(f"   Updated device {device_id} on port {port}")
+                print(f"   Updated device {device_id} on port {record.port_number}")
 
             except Exception as e:
-                print(f"   ❌ Failed to update device on port {port}: {e}")
+                print(f"   ❌ Failed to update device on port {record.port_number}: {e}")
 
     print(f"✅ Updated {updated_count} devices in database")
 
 
-def display_inventory(inventory):
-    """Display inventory results"""
+def display_inventory(port_items, connected_count):
+    """Display inventory results from sorted (port, device) pairs"""
     print(f"\n📊 Device Inventory Results:")
     print("=" * 80)
     print(f"{'Port':<4} {'Device Type':<15} {'Serial Number':<20} {'Manufacturer':<15}")
     print("-" * 80)
 
-    connected_count = 0
-    for port in sorted(inventory.keys()):
-        device = inventory[port]
-
+    for port, device in port_items:
         if device:
             print(f"{port:<4} {device['device_type']:<15} "
                   f"{device['serial'][:19]:<20} {device['manufacturer'][:14]:<15}")
-            connected_count += 1
         else:
             print(f"{port:<4} {'No Device':<15} {'-':<20} {'-':<15}")
 
     print("-" * 80)
-    print(f"Total ports scanned: {len(inventory)}")
+    print(f"Total ports scanned: {len(port_items)}")
     print(f"Devices connected: {connected_count}")
-    print(f"Empty ports: {len(inventory) - connected_count}")
+    print(f"Empty ports: {len(port_items) - connected_count}")
 
 
-def export_inventory(inventory, export_file):
+def export_inventory(inventory, port_items, export_file, pretty=False):
     """Export inventory to file"""
     export_path = Path(export_file)
 
     try:
         if export_path.suffix.lower() == '.json':
-            export_json(inventory, export_path)
+            export_json(inventory, export_path, pretty)
         elif export_path.suffix.lower() == '.csv':
-            export_csv(inventory, export_path)
+            export_csv(port_items, export_path)
         else:
             print(f"❌ Unsupported export format: {export_path.suffix}")
             return
@@ -376,24 +520,24 @@ def export_inventory(inventory, export_file):
         print(f"❌ Export failed: {e}")
 
 
-def export_json(inventory, file_path):
+def export_json(inventory, file_path, pretty=False):
     """Export inventory as JSON"""
     export_data = {
-        'scan_time': datetime.now().isoformat(),
-        'total_ports': len(inventory),
-        'connected_devices': sum(1 for d in inventory.values() if d),
-        'ports': inventory
+        'scan_time': inventory.scan_time.isoformat(),
+        'total_ports': len(inventory.ports),
+        'connected_devices': inventory.connected,
+        'ports': inventory.ports
     }
 
-    with open(file_path, 'w') as f:
-        json.dump(export_data, f, indent=2)
+    with open(file_path, 'w', buffering=EXPORT_BUFSIZE) as f:
+        json.dump(export_data, f, indent=2 if pretty else None)
 
 
-def export_csv(inventory, file_path):
-    """Export inventory as CSV"""
+def export_csv(port_items, file_path):
+    """Export sorted (port, device) pairs as CSV"""
     import csv
 
-    with open(file_path, 'w', newline='') as f:
+    with open(file_path, 'w', newline='', buffering=EXPORT_BUFSIZE) as f:
         writer = csv.writer(f)
 
         # Header
@@ -403,35 +547,18 @@ def export_csv(inventory, file_path):
         ])
 
         # Data
-        for port in sorted(inventory.keys()):
-            device = inventory[port]
-            if device:
-                writer.writerow([
-                    port,
-                    device['device_type'],
-                    device['vendor_id'],
-                    device['product_id'],
-                    device['serial'],
-                    device['manufacturer'],
-                    device['product_name']
-                ])
-            else:
-                writer.writerow([port, '', '', '', '', '', ''])
-
-
-def parse_port_list(port_spec):
-    """Parse port specification like '1,2,5-8' into list of port numbers"""
-    ports = []
-
-    for part in port_spec.split(','):
-        part = part.strip()
-        if '-' in part:
-            start, end = map(int, part.split('-'))
-            ports.extend(range(start, end + 1))
-        else:
-            ports.append(int(part))
-
-    return sorted(set(ports))
+        writer.writerows(
+            [
+                port,
+                device['device_type'],
+                device['vendor_id'],
+                device['product_id'],
+                device['serial'],
+                device['manufacturer'],
+                device['product_name']
+            ] if device else [port, '', '', '', '', '', '']
+            for port, device in port_items
+        )
 
 
 if __name__ == "__main__":
@@ -16,7 +16,7 @@ from pathlib import Path
 # Add parent directory to path to import hub_control
 sys.path.append(str(Path(__file__).parent.parent))
 
-from hub_control import HubController, load_config
+from hub_control import HubController, load_config, parse_port_list, ALL_PORTS
 
 
 def main():
@@ -43,7 +43,7 @@ def main():
 
     try:
         # Find STM32 devices
-        stm32_devices = find_stm32_devices(hub, args)
+        stm32_devices = find_stm32_devices(hub, args, config)
 
         if not stm32_devices:
             print("❌ No STM32 devices found")
@@ -53,24 +53,20 @@ def main():
         for device, port in stm32_devices:
             print(f"   Port {port}: {device.device_type} ({device.serial_number})")
 
-        # Enter DFU mode for each device
+        # BOOT0 and reset lines are shared by every port, so one sequence
+        # puts all connected STM32 devices into DFU mode together
         print(f"\n🔄 Entering DFU mode...")
 
-        success_count = 0
+        entered = enter_dfu_mode(hub)
+        success_count = len(stm32_devices) if entered else 0
         for device, port in stm32_devices:
-            print(f"   Port {port}: ", end="")
-
-            if enter_dfu_mode(hub, port, device.device_type):
-                print("✅ SUCCESS")
-                success_count += 1
-            else:
-                print("❌ FAILED")
+            print(f"   Port {port}: {'✅ SUCCESS' if entered else '❌ FAILED'}")
 
         print(f"\n📊 Results: {success_count}/{len(stm32_devices)} devices in DFU mode")
 
         # Verify DFU devices if requested
         if args.verify or args.list_devices:
-            time.sleep(2.0)  # Wait for USB re-enumeration
+            wait_for_dfu_devices(success_count)  # Wait for USB re-enumeration
             print(f"\n🔍 Checking DFU devices...")
             list_dfu_devices()
 
@@ -86,7 +82,7 @@ def main():
         hub.disconnect()
 
 
-def find_stm32_devices(hub, args):
+def find_stm32_devices(hub, args, config):
     """Find STM32 devices based on criteria"""
     stm32_devices = []
 
@@ -95,24 +91,24 @@ def find_stm32_devices(hub, args):
     if args.ports:
         target_ports = parse_port_list(args.ports)
     elif args.group:
-        config = load_config(args.config)
         group_config = config.get('port_groups', {}).get(args.group)
         if group_config:
             target_ports = group_config['ports']
     else:
-        target_ports = list(range(1, 33))
+        target_ports = ALL_PORTS
 
     # Check each port for STM32 devices
+    devices_by_port = hub.device_db.get_devices_by_ports(target_ports)
     for port in target_ports:
-        device = hub.device_db.get_device_by_port(port)
+        device = devices_by_port.get(port)
         if device and "STM32" in device.device_type.upper():
             stm32_devices.append((device, port))
 
     return stm32_devices
 
 
-def enter_dfu_mode(hub, port, device_type):
-    """Enter DFU mode for STM32 device"""
+def enter_dfu_mode(hub):
+    """Enter DFU mode for all STM32 devices sharing the boot/reset lines"""
     try:
         # STM32 DFU sequence: BOOT0 high, then reset
         # BOOT0 high selects system memory (DFU bootloader)
@@ -137,6 +133,33 @@ def enter_dfu_mode(hub, port, device_type):
         return False
 
 
+def wait_for_dfu_devices(expected, timeout=2.0):
+    """Poll sysfs until the expected number of DFU devices have enumerated"""
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        if count_dfu_devices() >= expected:
+            return True
+        time.sleep(0.1)
+
+    return False
+
+
+def count_dfu_devices():
+    """Count STM32 DFU bootloaders (0483:df11) currently on the USB bus"""
+    count = 0
+
+    for device_dir in Path("/sys/bus/usb/devices").glob("*-*"):
+        try:
+            if ((device_dir / "idVendor").read_text().strip() == "0483" and
+                    (device_dir / "idProduct").read_text().strip() == "df11"):
+                count += 1
+        except OSError:
+            continue
+
+    return count
+
+
 def list_dfu_devices():
     """List available DFU devices using dfu-util"""
     try:
@@ -168,20 +191,5 @@ def list_dfu_devices():
         print(f"   ❌ Error listing DFU devices: {e}")
 
 
-def parse_port_list(port_spec):
-    """Parse port specification like '1,2,5-8' into list of port numbers"""
-    ports = []
-
-    for part in port_spec.split(','):
-        part = part.strip()
-        if '-' in part:
-            start, end = map(int, part.split('-'))
-            ports.extend(range(start, end + 1))
-        else:
-            ports.append(int(part))
-
-    return sorted(set(ports))
-
-
 if __name__ == "__main__":
     sys.exit(main())
\ No newline at end of file
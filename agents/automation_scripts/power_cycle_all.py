@@ -14,21 +14,28 @@ from pathlib import Path
 # Add parent directory to path to import hub_control
 sys.path.append(str(Path(__file__).parent.parent))
 
-from hub_control import HubController, load_config
+from hub_control import HubController, load_config, parse_port_list, ALL_PORTS
 
 
 def main():
     parser = argparse.ArgumentParser(description="Power cycle all ports")
     parser.add_argument("--off-time", type=float, default=2.0,
                        help="Time to keep ports off (seconds)")
-    parser.add_argument("--delay", type=float, default=0.5,
-                       help="Delay between port operations (seconds)")
+    parser.add_argument("--delay", type=float, default=0.02,
+                       help="Gap between pipelined port commands (seconds)")
     parser.add_argument("--ports", help="Specific ports to cycle (e.g., 1,2,5-8)")
     parser.add_argument("--group", help="Port group to cycle")
     parser.add_argument("--config", default="../hub_config.yaml")
+    parser.add_argument("--unbuffered", action="store_true",
+                       help="Write progress output immediately (interactive use)")
 
     args = parser.parse_args()
 
+    # Block-buffer progress output; each phase flushes once when it completes.
+    # Captured or redirected stdout (e.g. a StringIO) has no reconfigure().
+    if not args.unbuffered and hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(line_buffering=False, write_through=False)
+
     # Load configuration
     config = load_config(args.config)
 
@@ -55,7 +62,7 @@ def main():
             ports_to_cycle = group_config['ports']
         else:
             # All ports 1-32
-            ports_to_cycle = list(range(1, 33))
+            ports_to_cycle = ALL_PORTS
 
         print(f"🔄 Power cycling ports: {ports_to_cycle}")
         print(f"   Off time: {args.off_time}s")
@@ -63,21 +70,20 @@ def main():
 
         # Phase 1: Turn off all specified ports
         print("\n📴 Turning off ports...")
-        for port in ports_to_cycle:
-            print(f"   Port {port}: OFF")
-            hub.power_port(port, "off")
-            time.sleep(args.delay)
+        hub.power_ports_batch([(port, "off") for port in ports_to_cycle], args.delay)
+        print(f"   Ports {ports_to_cycle}: OFF")
+        sys.stdout.flush()
 
         # Phase 2: Wait
         print(f"\n⏳ Waiting {args.off_time} seconds...")
+        sys.stdout.flush()
         time.sleep(args.off_time)
 
         # Phase 3: Turn ports back on
         print("\n🔌 Turning on ports...")
-        for port in ports_to_cycle:
-            print(f"   Port {port}: high")
-            hub.power_port(port, "high")
-            time.sleep(args.delay)
+        hub.power_ports_batch([(port, "high") for port in ports_to_cycle], args.delay)
+        print(f"   Ports {ports_to_cycle}: high")
+        sys.stdout.flush()
 
         print("\n✅ Power cycle completed successfully")
 
@@ -100,20 +106,5 @@ def main():
         hub.disconnect()
 
 
-def parse_port_list(port_spec):
-    """Parse port specification like '1,2,5-8' into list of port numbers"""
-    ports = []
-
-    for part in port_spec.split(','):
-        part = part.strip()
-        if '-' in part:
-            start, end = map(int, part.split('-'))
-            ports.extend(range(start, end + 1))
-        else:
-            ports.append(int(part))
-
-    return sorted(set(ports))  # Remove duplicates and sort
-
-
 if __name__ == "__main__":
     sys.exit(main())
\ No newline at end of file
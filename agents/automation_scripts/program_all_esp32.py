@@ -6,17 +6,77 @@ Automatically programs all detected ESP32 devices with specified firmware.
 Includes bootloader entry, flashing, and verification.
 """
 
+import os
 import sys
 import time
 import json
+import hashlib
+import logging
 import argparse
-import subprocess
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener
 from pathlib import Path
 
 # Add parent directory to path to import hub_control
 sys.path.append(str(Path(__file__).parent.parent))
 
-from hub_control import HubController, load_config, DeviceRecord
+from hub_control import (HubController, load_config, DeviceRecord, TestRecord,
+                         parse_port_list, ALL_PORTS)
+
+try:
+    from serial import SerialException
+    from serial.tools.list_ports import comports
+    from esptool.cmds import (detect_chip, run_stub, attach_flash, write_flash,
+                              verify_flash, reset_chip)
+    from esptool.loader import ESPLoader
+    from esptool.util import FatalError, NotImplementedInROMError
+    ESPTOOL_AVAILABLE = True
+except ImportError:
+    ESPTOOL_AVAILABLE = False
+
+# Highest reliable flashing baud per chip family; native USB-CDC chips are
+# not limited by a UART bridge
+DEFAULT_BAUD = 921600
+BAUD_BY_CHIP = {
+    "ESP32": 921600,
+    "ESP32-S2": 1500000,
+    "ESP32-S3": 1500000,
+    "ESP32-C3": 1500000,
+    "ESP32-P4": 2000000,
+}
+
+# USB vendor IDs of the serial bridges and native USB found on ESP32 boards:
+# CP210x, CH340, FTDI and Espressif
+ESP_USB_VIDS = frozenset({0x10C4, 0x1A86, 0x0403, 0x303A})
+
+# Bootloader readiness polling; esptool's connect retries the SYNC handshake
+# itself, so only the serial device node has to appear
+BOOTLOADER_TIMEOUT = 3.0
+BOOTLOADER_POLL = 0.05
+
+# Transient "packet header" timeouts are retried with backoff, the last
+# attempt writing uncompressed
+FLASH_ATTEMPTS = 3
+FLASH_RETRY_BACKOFF = 0.5
+
+# Status lines are batched and written together; errors flush immediately
+LOG_BUFFER_LINES = 64
+
+logger = logging.getLogger("program_all_esp32")
+logger.propagate = False  # Keep hub_control's timestamped handlers out of it
+
+# Machine-readable result events, enabled by --json-log
+events = logging.getLogger("program_all_esp32.events")
+events.propagate = False
+
+# Firmware image read once at startup and shared by every device
+Firmware = namedtuple('Firmware', ['name', 'stem', 'data', 'sha256'])
+
+# Set in each pool worker by init_worker so the image is pickled once per process
+_worker_firmware = None
 
 
 def main():
@@ -26,18 +86,44 @@ def main():
                        help="Device type filter (ESP32, ESP32-S2, ESP32-C3, ESP32-S3)")
     parser.add_argument("--ports", help="Specific ports to program (e.g., 1,2,5-8)")
     parser.add_argument("--group", help="Port group to program")
-    parser.add_argument("--baud", type=int, default=921600, help="Flash baud rate")
+    parser.add_argument("--baud", type=int,
+                       help="Flash baud rate (default: fastest safe rate for the chip)")
     parser.add_argument("--address", default="0x1000", help="Flash address")
-    parser.add_argument("--verify", action="store_true", help="Verify after flashing")
-    parser.add_argument("--parallel", type=int, default=1, help="Parallel programming count")
+    parser.add_argument("--reset-method", choices=["power", "pin"], default="power",
+                       help="Enter the bootloader by power-cycling ports or by pulsing reset")
+    parser.add_argument("--force-write", action="store_true",
+                       help="Rewrite flash even where it already holds the image")
+    parser.add_argument("--verify", action="store_true",
+                       help="Report the on-chip hash check esptool runs after every write")
+    parser.add_argument("--deep-verify", action="store_true",
+                       help="Also read the whole image back from flash after writing")
+    parser.add_argument("--parallel", type=int, default=os.cpu_count() or 1,
+                       help="Parallel programming count (default: CPU count)")
+    parser.add_argument("--json-log", help="Append one JSON line per device result to this file")
+    parser.add_argument("--yes", "-y", action="store_true",
+                       help="Proceed without asking for confirmation")
     parser.add_argument("--config", default="../hub_config.yaml")
 
     args = parser.parse_args()
 
-    # Validate firmware file
-    firmware_path = Path(args.firmware)
-    if not firmware_path.exists():
-        print(f"❌ Firmware file not found: {args.firmware}")
+    # Handlers are removed again so repeated in-process runs don't stack them
+    handlers = setup_output(args.json_log)
+    try:
+        return program_all(args)
+    finally:
+        teardown_output(handlers)
+
+
+def program_all(args):
+    """Program every matching device; returns the exit code"""
+    # Load the firmware file; nothing touches the filesystem for it afterwards
+    try:
+        firmware = load_firmware(Path(args.firmware))
+    except FileNotFoundError:
+        logger.error(f"❌ Firmware file not found: {args.firmware}")
+        return 1
+    except OSError as e:
+        logger.error(f"❌ Cannot read firmware file {args.firmware}: {e}")
         return 1
 
     # Load configuration
@@ -47,61 +133,118 @@ def main():
     hub = HubController(config=config)
 
     if not hub.connect():
-        print("❌ Failed to connect to USBFlashHub")
+        logger.error("❌ Failed to connect to USBFlashHub")
         return 1
 
     try:
         # Find ESP32 devices to program
-        devices_to_program = find_target_devices(hub, args)
+        devices_to_program = find_target_devices(hub, args, config)
 
         if not devices_to_program:
-            print(f"❌ No {args.device_type} devices found to program")
+            logger.error(f"❌ No {args.device_type} devices found to program")
             return 1
 
-        print(f"📱 Found {len(devices_to_program)} {args.device_type} devices to program:")
+        # Hub port -> USB location; each device node is looked up there only
+        # after bootloader entry, as re-enumeration reorders ttyUSB/ttyACM numbers
+        usb_topology = config.get('usb_topology') or {}
+
+        logger.info(f"📱 Found {len(devices_to_program)} {args.device_type} devices to program:")
         for device, port in devices_to_program:
-            print(f"   Port {port}: {device.device_type} ({device.serial_number})")
+            logger.info(f"   Port {port}: {device.device_type} ({device.serial_number})")
 
         # Confirm operation
-        if not confirm_operation(devices_to_program, firmware_path):
-            print("❌ Operation cancelled")
+        if not confirm_operation(devices_to_program, firmware, args):
+            logger.error("❌ Operation cancelled")
             return 1
 
         # Program devices
         success_count = 0
         total_count = len(devices_to_program)
 
-        print(f"\n🔧 Starting programming process...")
+        logger.info(f"\n🔧 Starting programming process...")
 
         if args.parallel > 1:
-            success_count = program_devices_parallel(hub, devices_to_program, args)
+            success_count = program_devices_parallel(hub, devices_to_program, firmware,
+                                                     usb_topology, args)
         else:
-            success_count = program_devices_sequential(hub, devices_to_program, args)
+            success_count = program_devices_sequential(hub, devices_to_program, firmware,
+                                                       usb_topology, args)
 
         # Report results
-        print(f"\n📊 Programming Results:")
-        print(f"   Total devices: {total_count}")
-        print(f"   Successful: {success_count}")
-        print(f"   Failed: {total_count - success_count}")
+        log_event(event="summary", firmware=firmware.name, sha256=firmware.sha256,
+                  total=total_count, successful=success_count,
+                  failed=total_count - success_count)
+
+        logger.info(f"\n📊 Programming Results:")
+        logger.info(f"   Total devices: {total_count}")
+        logger.info(f"   Successful: {success_count}")
+        logger.info(f"   Failed: {total_count - success_count}")
 
         if success_count == total_count:
-            print("✅ All devices programmed successfully!")
+            logger.info("✅ All devices programmed successfully!")
             return 0
         else:
-            print("⚠️  Some devices failed to program")
+            logger.warning("⚠️  Some devices failed to program")
             return 1
 
     except KeyboardInterrupt:
-        print("\n⚠️  Operation interrupted")
+        logger.warning("\n⚠️  Operation interrupted")
         return 1
     except Exception as e:
-        print(f"❌ Error: {e}")
+        logger.error(f"❌ Error: {e}")
         return 1
     finally:
         hub.disconnect()
 
 
-def find_target_devices(hub, args):
+def setup_output(json_log=None):
+    """Send status lines to stdout through a buffering handler
+
+    Returns the (logger, handler) pairs added, for teardown_output.
+    """
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter('%(message)s'))
+    buffered = MemoryHandler(LOG_BUFFER_LINES, flushLevel=logging.ERROR, target=stream)
+    logger.addHandler(buffered)
+    logger.setLevel(logging.INFO)
+    handlers = [(logger, buffered)]
+
+    if json_log:
+        json_handler = logging.FileHandler(json_log)
+        events.addHandler(json_handler)
+        events.setLevel(logging.INFO)
+        handlers.append((events, json_handler))
+
+    return handlers
+
+
+def teardown_output(handlers):
+    """Flush and remove the handlers added by setup_output"""
+    for owner, handler in handlers:
+        owner.removeHandler(handler)
+        handler.close()  # MemoryHandler.close() flushes to its target first
+
+
+def log_event(**fields):
+    """Write one JSON line to the --json-log file"""
+    if events.handlers:
+        events.info(json.dumps(fields))
+
+
+def flush_output():
+    """Write out buffered status lines"""
+    for handler in logger.handlers:
+        handler.flush()
+
+
+def load_firmware(firmware_path):
+    """Read the firmware image and its hash once for the whole run"""
+    data = firmware_path.read_bytes()
+    return Firmware(firmware_path.name, firmware_path.stem, data,
+                    hashlib.sha256(data).hexdigest())
+
+
+def find_target_devices(hub, args, config):
     """Find devices to program based on criteria"""
     devices_to_program = []
 
@@ -110,185 +253,326 @@ def find_target_devices(hub, args):
     if args.ports:
         target_ports = parse_port_list(args.ports)
     elif args.group:
-        config = load_config(args.config)
         group_config = config.get('port_groups', {}).get(args.group)
         if group_config:
             target_ports = group_config['ports']
     else:
-        target_ports = list(range(1, 33))
+        target_ports = ALL_PORTS
 
     # Check each port for target devices
+    devices_by_port = hub.device_db.get_devices_by_ports(target_ports)
     for port in target_ports:
-        device = hub.device_db.get_device_by_port(port)
+        device = devices_by_port.get(port)
         if device and args.device_type.upper() in device.device_type.upper():
             devices_to_program.append((device, port))
 
     return devices_to_program
 
 
-def confirm_operation(devices, firmware_path):
+def find_serial_port(port, location):
+    """Current serial device for a hub port, or None if it isn't there
+
+    With a USB location from usb_topology the device is found by where it is
+    plugged in; otherwise ttyUSB order is guessed from the port number.
+    """
+    if location and ESPTOOL_AVAILABLE:
+        for info in comports():
+            # Linux locations are the sysfs device name plus ":config.interface"
+            if info.vid in ESP_USB_VIDS and info.location and info.location.split(':')[0] == location:
+                return info.device
+        return None
+
+    guess = f"/dev/ttyUSB{port-1}"
+    return guess if os.path.exists(guess) else None
+
+
+def confirm_operation(devices, firmware, args):
     """Confirm programming operation with user"""
-    print(f"\n⚠️  About to program {len(devices)} devices with:")
-    print(f"   Firmware: {firmware_path.name}")
-    print(f"   Size: {firmware_path.stat().st_size} bytes")
+    logger.warning(f"\n⚠️  About to program {len(devices)} devices with:")
+    logger.info(f"   Firmware: {firmware.name}")
+    logger.info(f"   Size: {len(firmware.data)} bytes")
+    logger.info(f"   SHA-256: {firmware.sha256}")
+
+    # Nobody can answer the prompt under automation
+    if args.yes or not sys.stdin.isatty():
+        logger.info("   Proceeding without confirmation")
+        return True
 
+    flush_output()
     response = input("\nProceed? (y/N): ").strip().lower()
     return response in ['y', 'yes']
 
 
-def program_devices_sequential(hub, devices_to_program, args):
+def program_devices_sequential(hub, devices_to_program, firmware, usb_topology, args):
     """Program devices one by one"""
     success_count = 0
+    results = []
 
     for i, (device, port) in enumerate(devices_to_program):
-        print(f"\n📱 Programming device {i+1}/{len(devices_to_program)} on port {port}")
+        logger.info(f"\n📱 Programming device {i+1}/{len(devices_to_program)} on port {port}")
+
+        result = program_single_device(hub, device, port, usb_topology.get(port),
+                                       firmware, args)
+        if result:
+            results.append(result)
+
+        success = result is not None and result.result == "PASSED"
+        log_event(event="flash", port=port, device_type=device.device_type,
+                  serial_number=device.serial_number,
+                  status="ok" if success else "failed",
+                  error=result.error_message if result else None)
 
-        if program_single_device(hub, device, port, args):
+        if success:
             success_count += 1
-            print(f"   ✅ Port {port}: SUCCESS")
+            logger.info(f"   ✅ Port {port}: SUCCESS")
         else:
-            print(f"   ❌ Port {port}: FAILED")
+            logger.error(f"   ❌ Port {port}: FAILED")
 
+    hub.device_db.add_test_results(results)
     return success_count
 
 
-def program_devices_parallel(hub, devices_to_program, args):
-    """Program multiple devices in parallel (simplified implementation)"""
-    # For now, implement as sequential with shorter delays
-    # True parallel programming would require thread pool
-    print("⚠️  Parallel programming not fully implemented, using sequential mode")
-    return program_devices_sequential(hub, devices_to_program, args)
+def program_devices_parallel(hub, devices_to_program, firmware, usb_topology, args):
+    """Program multiple devices in parallel, one esptool worker process per port"""
+    # The boot and reset lines are shared by every port, so a single
+    # bootloader sequence readies all devices before the workers start
+    logger.info(f"   🔄 Entering bootloader mode on all ports...")
+
+    if not enter_bootloader(hub, devices_to_program, args):
+        logger.error(f"   ❌ Failed to enter bootloader mode")
+        return 0
+
+    success_count = 0
+    results = []
+
+    # Worker status lines travel over a queue into this process's buffered handler
+    context = worker_context()
+    log_queue = context.Queue()
+    listener = QueueListener(log_queue, *logger.handlers)
+    listener.start()
+
+    try:
+        # Never start more workers than there are devices to flash
+        workers = min(args.parallel, len(devices_to_program))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=init_worker,
+                                 initargs=(firmware, log_queue)) as executor:
+            futures = {
+                executor.submit(flash_device_in_worker, port, usb_topology.get(port),
+                                device.device_type, args): (device, port)
+                for device, port in devices_to_program
+            }
+
+            # Workers only touch their own serial port; database writes stay here
+            for future in as_completed(futures):
+                device, port = futures[future]
+                try:
+                    success = future.result()
+                    error = None
+                except Exception as e:
+                    success = False
+                    error = str(e)
+                    logger.error(f"   ❌ Error programming device on port {port}: {e}")
+
+                if success or error:
+                    results.append(flash_result(device, port, firmware, success, error))
+
+                log_event(event="flash", port=port, device_type=device.device_type,
+                          serial_number=device.serial_number,
+                          status="ok" if success else "failed", error=error)
+
+                if success:
+                    success_count += 1
+                    logger.info(f"   ✅ Port {port}: SUCCESS")
+                else:
+                    logger.error(f"   ❌ Port {port}: FAILED")
+    finally:
+        listener.stop()
+
+    # Database writes stay in the parent, batched into a single transaction
+    hub.device_db.add_test_results(results)
+    return success_count
 
 
-def program_single_device(hub, device, port, args):
-    """Program a single device"""
+def program_single_device(hub, device, port, location, firmware, args):
+    """Program a single device, returning its flash result or None if not attempted"""
     try:
-        print(f"   🔄 Entering bootloader mode...")
+        logger.info(f"   🔄 Entering bootloader mode...")
 
         # Enter bootloader mode
-        if not hub.enter_bootloader_mode(port, device.device_type):
-            print(f"   ❌ Failed to enter bootloader mode")
-            return False
+        if not enter_bootloader(hub, [(device, port)], args):
+            logger.error(f"   ❌ Failed to enter bootloader mode")
+            return None
 
-        time.sleep(1.0)  # Wait for bootloader
+        if not flash_device(port, location, device.device_type, firmware, args):
+            return None
 
-        # Flash firmware
-        print(f"   📥 Flashing firmware...")
+        return flash_result(device, port, firmware, True)
 
-        # Detect serial port (simplified - in real implementation would scan for device)
-        serial_port = f"/dev/ttyUSB{port-1}"  # Approximate mapping
+    except Exception as e:
+        logger.error(f"   ❌ Error programming device: {e}")
+        return flash_result(device, port, firmware, False, str(e))
 
-        if not flash_with_esptool(serial_port, args.firmware, args):
-            print(f"   ❌ Flashing failed")
-            return False
 
-        # Reset device
-        print(f"   🔄 Resetting device...")
-        hub.pulse_reset(100)
-        time.sleep(2.0)
+def worker_context():
+    """Start workers from a small fork server instead of forking this process
 
-        # Verify if requested
-        if args.verify:
-            print(f"   🔍 Verifying firmware...")
-            if not verify_firmware(serial_port, args.firmware, args):
-                print(f"   ⚠️  Verification failed")
-                return False
+    The parent holds the hub WebSocket threads and a large heap; forking it per
+    worker copies page tables only to discard them and is unsafe with threads.
+    """
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['esptool'])
+    return context
 
-        # Record success in database
-        hub.device_db.add_test_result(
-            device.id,
-            f"firmware_flash_{Path(args.firmware).stem}",
-            "PASSED",
-            0,  # Duration would be calculated in real implementation
-            None,
-            None,
-            port
-        )
 
-        return True
+def enter_bootloader(hub, devices, args):
+    """Put devices into bootloader mode, preferring a per-port power cycle"""
+    if args.reset_method == "power":
+        if hub.enter_bootloader_by_power([port for _, port in devices]):
+            return True
+        logger.warning(f"   ⚠️  Power-cycle entry failed, pulsing reset instead")
 
-    except Exception as e:
-        print(f"   ❌ Error programming device: {e}")
-
-        # Record failure in database
-        hub.device_db.add_test_result(
-            device.id,
-            f"firmware_flash_{Path(args.firmware).stem}",
-            "FAILED",
-            0,
-            str(e),
-            None,
-            port
-        )
+    first_device, first_port = devices[0]
+    return hub.enter_bootloader_mode(first_port, first_device.device_type)
 
-        return False
 
+def init_worker(firmware, log_queue):
+    """Keep the firmware image in the pool worker and route its status lines to the parent"""
+    global _worker_firmware
+    _worker_firmware = firmware
 
-def flash_with_esptool(port, firmware_file, args):
-    """Flash firmware using esptool"""
-    cmd = [
-        "esptool.py",
-        "--port", port,
-        "--baud", str(args.baud),
-        "write_flash",
-        args.address, firmware_file
-    ]
+    logger.handlers = [QueueHandler(log_queue)]
+    logger.setLevel(logging.INFO)
 
-    try:
-        print(f"   📡 Running: esptool.py --port {port} --baud {args.baud} write_flash {args.address} {Path(firmware_file).name}")
 
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+def flash_device_in_worker(port, location, device_type, args):
+    """Pool entry point using the image handed over by init_worker"""
+    return flash_device(port, location, device_type, _worker_firmware, args)
 
-        if result.returncode == 0:
-            return True
-        else:
-            print(f"   ❌ esptool error: {result.stderr}")
-            return False
 
-    except subprocess.TimeoutExpired:
-        print(f"   ❌ esptool timeout")
+def flash_device(port, location, device_type, firmware, args):
+    """Flash and optionally verify a device that is already in bootloader mode
+
+    Runs in pool worker processes, so it must not use the hub connection.
+    """
+    baud = flash_baud(device_type, args)
+
+    serial_port = wait_for_serial_port(port, location)
+    if not serial_port:
+        logger.error(f"   ❌ Port {port}: serial device did not appear")
         return False
-    except FileNotFoundError:
-        print(f"   ❌ esptool not found - install with: pip install esptool")
+
+    # Flash firmware
+    logger.info(f"   📥 Port {port}: Flashing firmware via {serial_port}...")
+
+    if not flash_with_esptool(serial_port, firmware, baud, args):
+        logger.error(f"   ❌ Port {port}: Flashing failed")
         return False
 
+    # write_flash has already compared the on-chip MD5 of every written region
+    if args.verify and not args.deep_verify:
+        logger.info(f"   🔍 Port {port}: Flash hash verified")
 
-def verify_firmware(port, firmware_file, args):
-    """Verify flashed firmware"""
-    # Simple verification by reading back and comparing
-    # In practice, this might check specific addresses or use checksums
-    cmd = [
-        "esptool.py",
-        "--port", port,
-        "--baud", str(args.baud),
-        "verify_flash",
-        args.address, firmware_file
-    ]
+    return True
 
-    try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-        return result.returncode == 0
 
-    except subprocess.TimeoutExpired:
-        print(f"   ❌ verify timeout")
+def flash_result(device, port, firmware, success, error=None):
+    """Build the test history record for a flashing attempt"""
+    return TestRecord(
+        device.id,
+        f"firmware_flash_{firmware.stem}",
+        "PASSED" if success else "FAILED",
+        0,  # Duration would be calculated in real implementation
+        error,
+        f"sha256:{firmware.sha256}",
+        port
+    )
+
+
+@contextmanager
+def esptool_session(port, baud):
+    """Connect to the ROM bootloader, load the flasher stub and raise the baud rate"""
+    with detect_chip(port=port) as esp:
+        esp = run_stub(esp)
+
+        if baud > ESPLoader.ESP_ROM_BAUD:
+            try:
+                esp.change_baud(baud)
+            except NotImplementedInROMError:
+                pass  # Native USB ROMs keep the initial rate
+
+        attach_flash(esp)
+        yield esp
+
+
+def wait_for_serial_port(port, location, timeout=BOOTLOADER_TIMEOUT):
+    """Wait for the port's bootloader serial device instead of a fixed sleep
+
+    Returns its device path, or None if it doesn't appear in time.
+    """
+    deadline = time.monotonic() + timeout
+    while not (serial_port := find_serial_port(port, location)):
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(BOOTLOADER_POLL)
+
+    return serial_port
+
+
+def flash_baud(device_type, args):
+    """Pick the flashing baud rate, preferring an explicit --baud"""
+    if args.baud:
+        return args.baud
+
+    return BAUD_BY_CHIP.get(device_type.upper(), DEFAULT_BAUD)
+
+
+def flash_with_esptool(port, firmware, baud, args):
+    """Flash and optionally read back firmware in one esptool session"""
+    if not ESPTOOL_AVAILABLE:
+        logger.error(f"   ❌ esptool not found - install with: pip install esptool")
         return False
-    except FileNotFoundError:
-        return True  # If esptool not available, skip verification
 
+    logger.info(f"   📡 esptool --port {port} --baud {baud} write-flash {args.address} {firmware.name}")
 
-def parse_port_list(port_spec):
-    """Parse port specification like '1,2,5-8' into list of port numbers"""
-    ports = []
+    for attempt in range(FLASH_ATTEMPTS):
+        # Highly compressible images can stall the stub; fall back to raw writes
+        no_compress = attempt == FLASH_ATTEMPTS - 1 and attempt > 0
 
-    for part in port_spec.split(','):
-        part = part.strip()
-        if '-' in part:
-            start, end = map(int, part.split('-'))
-            ports.extend(range(start, end + 1))
-        else:
-            ports.append(int(part))
+        # esptool prints straight to stdout; write out the buffered status
+        # lines first so they come before its output
+        flush_output()
+
+        try:
+            with esptool_session(port, baud) as esp:
+                # skip_flashed compares the on-chip MD5 first, so boards that already
+                # hold the image are neither erased nor rewritten. Progress bars from
+                # concurrent workers would interleave on one terminal
+                write_flash(esp, [(int(args.address, 0), firmware.data)],
+                            no_compress=no_compress,
+                            skip_flashed=not args.force_write,
+                            no_progress=args.parallel > 1)
+
+                # A requested deep verify reuses the connected stub and baud rate
+                if args.deep_verify:
+                    logger.info(f"   🔍 {port}: Reading back firmware...")
+                    flush_output()
+                    verify_flash(esp, [(int(args.address, 0), firmware.data)])
+
+                reset_chip(esp, "hard-reset")
+
+            return True
+
+        except (FatalError, SerialException) as e:
+            if "packet header" not in str(e) or attempt == FLASH_ATTEMPTS - 1:
+                logger.error(f"   ❌ esptool error: {e}")
+                return False
+
+            delay = FLASH_RETRY_BACKOFF * (2 ** attempt)
+            logger.info(f"   🔁 {port}: {e} - retrying in {delay:.1f}s")
+            time.sleep(delay)
 
-    return sorted(set(ports))
+    return False
 
 
 if __name__ == "__main__":
@@ -13,7 +13,6 @@ A comprehensive control and monitoring system for the USBFlashHub that provides:
 Author: USBFlashHub Control System
 """
 
-import asyncio
 import json
 import logging
 import sqlite3
@@ -22,9 +21,10 @@ import subprocess
 import signal
 import sys
 import threading
+import queue
 import argparse
-from dataclasses import dataclass, field, asdict
-from typing import Dict, List, Optional, Any, Callable, Tuple
+from dataclasses import dataclass, field, fields, is_dataclass
+from typing import Dict, List, Optional, Any, Callable, Tuple, Mapping, Iterable, Iterator
 from pathlib import Path
 from datetime import datetime, timedelta
 import yaml
@@ -33,6 +33,12 @@ import cmd
 from contextlib import contextmanager
 import re
 import os
+import io
+import importlib.util
+import hashlib
+from contextlib import redirect_stdout, redirect_stderr
+from functools import lru_cache
+from types import MappingProxyType
 
 try:
     from rich.console import Console
@@ -57,6 +63,21 @@ try:
 except ImportError:
     FLASK_AVAILABLE = False
 
+try:
+    from waitress import serve
+    WAITRESS_AVAILABLE = True
+except ImportError:
+    WAITRESS_AVAILABLE = False
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Every port across the maximum of 8 hubs (4 ports each)
+ALL_PORTS: Tuple[int, ...] = tuple(range(1, 33))
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -69,7 +90,12 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-@dataclass
+# Records are built per database row and port; slots drop the per-instance
+# __dict__ where the interpreter supports them (Python 3.10+)
+DATACLASS_OPTIONS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**DATACLASS_OPTIONS)
 class DeviceRecord:
     """Database record for a tracked device"""
     id: Optional[int] = None
@@ -89,7 +115,19 @@ class DeviceRecord:
     notes: Optional[str] = None
 
 
-@dataclass
+@dataclass(**DATACLASS_OPTIONS)
+class TestRecord:
+    """Test history entry waiting to be written to the database"""
+    device_id: int
+    test_name: str
+    result: str
+    duration: float = 0
+    error_message: Optional[str] = None
+    firmware_version: Optional[str] = None
+    port_number: Optional[int] = None
+
+
+@dataclass(**DATACLASS_OPTIONS)
 class PortStatus:
     """Status information for a hub port"""
     port_number: int
@@ -99,7 +137,7 @@ class PortStatus:
     last_activity: Optional[datetime] = None
 
 
-@dataclass
+@dataclass(**DATACLASS_OPTIONS)
 class HubStatus:
     """Status information for a hub"""
     hub_number: int
@@ -109,6 +147,195 @@ class HubStatus:
     last_communication: Optional[datetime] = None
 
 
+@lru_cache(maxsize=None)
+def _dataclass_field_names(cls) -> Tuple[str, ...]:
+    """Field names of a dataclass, introspected once per type"""
+    return tuple(f.name for f in fields(cls))
+
+
+def _json_default(value):
+    """Encode records and timestamps that the json module cannot handle itself"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if is_dataclass(value):
+        return {name: getattr(value, name) for name in _dataclass_field_names(type(value))}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _dumps_json(obj) -> bytes:
+    """Serialize an API payload; orjson encodes dataclasses and datetimes natively"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    # Compact, UTF-8 output, matching what orjson produces
+    return json.dumps(obj, default=_json_default, separators=(',', ':'),
+                      ensure_ascii=False).encode()
+
+
+def _iter_json_array(items: Iterable) -> Iterator[bytes]:
+    """Serialize items as a JSON array one element at a time"""
+    yield b'['
+    try:
+        for i, item in enumerate(items):
+            yield b',' + _dumps_json(item) if i else _dumps_json(item)
+    except Exception as e:
+        # Headers are already sent, so end the array with what was produced
+        logger.error(f"Failed while streaming JSON: {e}")
+    yield b']'
+
+
+# Per-connection SQLite tuning; WAL itself is persistent and set once on the file
+SQLITE_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA wal_autocheckpoint=1000",
+)
+
+# Pooled read-only connections alongside the single writer connection;
+# enough for every REST API worker thread (API_THREADS) to read at once
+DB_READER_CONNECTIONS = 8
+
+# SQL used on hot paths, kept as constants so each connection's statement
+# cache can reuse the compiled statement
+SQL_SELECT_DEVICE_ID = """
+    SELECT id FROM devices
+    WHERE vendor_id = ? AND product_id = ? AND serial_number = ?
+"""
+
+SQL_UPDATE_DEVICE = """
+    UPDATE devices SET
+        last_seen = ?, port_number = ?, device_type = ?,
+        manufacturer = ?, product_name = ?
+    WHERE id = ?
+"""
+
+SQL_INSERT_DEVICE = """
+    INSERT INTO devices
+    (vendor_id, product_id, device_type, serial_number, manufacturer,
+     product_name, port_number, first_seen, last_seen)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Single-statement insert-or-update, available from SQLite 3.35 (RETURNING)
+SQLITE_HAS_UPSERT_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+SQL_UPSERT_DEVICE = """
+    INSERT INTO devices
+    (vendor_id, product_id, device_type, serial_number, manufacturer,
+     product_name, port_number, first_seen, last_seen)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (vendor_id, product_id, serial_number) DO UPDATE SET
+        last_seen = excluded.last_seen, port_number = excluded.port_number,
+        device_type = excluded.device_type, manufacturer = excluded.manufacturer,
+        product_name = excluded.product_name
+    RETURNING id
+"""
+
+SQL_DEVICE_BY_SERIAL = "SELECT * FROM devices WHERE serial_number = ?"
+
+SQL_DEVICES_BY_TYPE = "SELECT * FROM devices WHERE device_type LIKE ? ORDER BY last_seen DESC"
+
+SQL_RECENT_DEVICES = "SELECT * FROM devices ORDER BY last_seen DESC LIMIT ?"
+
+SQL_DEVICE_BY_PORT = """
+    SELECT * FROM devices
+    WHERE port_number = ?
+    ORDER BY last_seen DESC LIMIT 1
+"""
+
+SQL_INSERT_TEST_HISTORY = """
+    INSERT INTO test_history
+    (device_id, test_name, test_result, duration_seconds, error_message,
+     firmware_version, port_number)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+SQL_DEVICE_TEST_HISTORY = """
+    SELECT th.*, d.device_type, d.serial_number
+    FROM test_history th
+    JOIN devices d ON th.device_id = d.id
+    WHERE th.device_id = ?
+    ORDER BY th.test_time DESC LIMIT ?
+"""
+
+SQL_TEST_HISTORY = """
+    SELECT th.*, d.device_type, d.serial_number
+    FROM test_history th
+    JOIN devices d ON th.device_id = d.id
+    ORDER BY th.test_time DESC LIMIT ?
+"""
+
+# One LIKE over the joined text fields instead of five; the unit separator
+# keeps matches from spanning two fields
+SQL_SEARCH_DEVICES = """
+    SELECT * FROM devices
+    WHERE IFNULL(device_type, '') || char(31) || IFNULL(manufacturer, '') || char(31) ||
+          IFNULL(product_name, '') || char(31) || IFNULL(serial_number, '') || char(31) ||
+          IFNULL(notes, '') LIKE ?
+    ORDER BY last_seen DESC LIMIT ?
+"""
+
+# Trigram full-text index over the searchable device fields; matches any
+# substring of three or more characters without scanning the table
+SQL_CREATE_DEVICES_FTS = """
+    CREATE VIRTUAL TABLE devices_fts USING fts5(
+        device_type, manufacturer, product_name, serial_number, notes,
+        content='devices', content_rowid='id', tokenize='trigram'
+    );
+
+    CREATE TRIGGER devices_fts_insert AFTER INSERT ON devices BEGIN
+        INSERT INTO devices_fts (rowid, device_type, manufacturer, product_name,
+                                 serial_number, notes)
+        VALUES (new.id, new.device_type, new.manufacturer, new.product_name,
+                new.serial_number, new.notes);
+    END;
+
+    CREATE TRIGGER devices_fts_delete AFTER DELETE ON devices BEGIN
+        INSERT INTO devices_fts (devices_fts, rowid, device_type, manufacturer,
+                                 product_name, serial_number, notes)
+        VALUES ('delete', old.id, old.device_type, old.manufacturer, old.product_name,
+                old.serial_number, old.notes);
+    END;
+
+    CREATE TRIGGER devices_fts_update
+    AFTER UPDATE OF device_type, manufacturer, product_name, serial_number, notes
+    ON devices BEGIN
+        INSERT INTO devices_fts (devices_fts, rowid, device_type, manufacturer,
+                                 product_name, serial_number, notes)
+        VALUES ('delete', old.id, old.device_type, old.manufacturer, old.product_name,
+                old.serial_number, old.notes);
+        INSERT INTO devices_fts (rowid, device_type, manufacturer, product_name,
+                                 serial_number, notes)
+        VALUES (new.id, new.device_type, new.manufacturer, new.product_name,
+                new.serial_number, new.notes);
+    END;
+
+    INSERT INTO devices_fts (devices_fts) VALUES ('rebuild');
+"""
+
+SQL_SEARCH_DEVICES_FTS = """
+    SELECT d.* FROM devices_fts f
+    JOIN devices d ON d.id = f.rowid
+    WHERE devices_fts MATCH ?
+    ORDER BY d.last_seen DESC LIMIT ?
+"""
+
+# Statements kept compiled per connection
+SQLITE_CACHED_STATEMENTS = 256
+
+# Seconds a read query result is reused; any write clears the cache
+QUERY_CACHE_TTL = 0.5
+QUERY_CACHE_SIZE = 64
+
+
+@lru_cache(maxsize=1024)
+def _parse_timestamp(value: str) -> datetime:
+    """Parse a stored timestamp; devices from one scan share the same string"""
+    return datetime.fromisoformat(value)
+
+
 class DeviceDatabase:
     """SQLite database for tracking devices and test history"""
 
@@ -117,10 +344,30 @@ class DeviceDatabase:
         self.logger = logging.getLogger(f"{__name__}.DeviceDatabase")
         self._init_database()
 
+        # Connections stay open for the life of the database object
+        self._writer = self._open_connection()
+        self._writer_lock = threading.RLock()
+        self._readers = queue.Queue()
+        for _ in range(DB_READER_CONNECTIONS):
+            self._readers.put(self._open_connection(readonly=True))
+
+        # (method, args) -> (expiry, result); cache_epoch counts writes
+        self._query_cache = {}
+        self._cache_lock = threading.Lock()
+        self.cache_epoch = 0
+        # Last PRAGMA data_version seen on the writer, which moves when
+        # another connection or process commits to the file
+        self._data_version = None
+
     def _init_database(self):
         """Initialize the SQLite database with required tables"""
         try:
             with sqlite3.connect(self.db_path) as conn:
+                # WAL lets readers proceed during writes and halves fsyncs per commit
+                if self.db_path != ":memory:":
+                    conn.execute("PRAGMA journal_mode=WAL")
+                self._configure_connection(conn)
+
                 conn.execute("""
                     CREATE TABLE IF NOT EXISTS devices (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -169,6 +416,38 @@ class DeviceDatabase:
                     )
                 """)
 
+                # Indexes for the lookup, ordering and join columns
+                conn.executescript("""
+                    CREATE INDEX IF NOT EXISTS idx_devices_serial
+                        ON devices (serial_number);
+                    CREATE INDEX IF NOT EXISTS idx_devices_port
+                        ON devices (port_number, last_seen DESC);
+                    CREATE INDEX IF NOT EXISTS idx_devices_type
+                        ON devices (device_type, last_seen DESC);
+                    CREATE INDEX IF NOT EXISTS idx_devices_last_seen
+                        ON devices (last_seen DESC);
+                    CREATE INDEX IF NOT EXISTS idx_test_history_device_time
+                        ON test_history (device_id, test_time DESC);
+                    CREATE INDEX IF NOT EXISTS idx_test_history_time
+                        ON test_history (test_time DESC);
+                    CREATE INDEX IF NOT EXISTS idx_port_history_port
+                        ON port_history (port_number, connected_time DESC);
+                """)
+
+                # Keep device test statistics in step with every history insert
+                conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS test_history_stats
+                    AFTER INSERT ON test_history BEGIN
+                        UPDATE devices SET
+                            test_count = test_count + 1,
+                            last_test_result = new.test_result,
+                            last_test_time = strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')
+                        WHERE id = new.device_id;
+                    END
+                """)
+
+                self.fts_enabled = self._init_search_index(conn)
+
                 conn.commit()
                 self.logger.info("Database initialized successfully")
 
@@ -176,70 +455,167 @@ class DeviceDatabase:
             self.logger.error(f"Failed to initialize database: {e}")
             raise
 
-    @contextmanager
-    def get_connection(self):
-        """Get a database connection with automatic cleanup"""
-        conn = sqlite3.connect(self.db_path)
+    def _open_connection(self, readonly: bool = False) -> sqlite3.Connection:
+        """Open a configured connection that may be shared between threads"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               cached_statements=SQLITE_CACHED_STATEMENTS)
         conn.row_factory = sqlite3.Row
+        self._configure_connection(conn)
+        if readonly:
+            # A stray write through a reader fails instead of bypassing the writer lock
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def _init_search_index(self, conn: sqlite3.Connection) -> bool:
+        """Create the full-text device index if SQLite supports it"""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'devices_fts'"
+        ).fetchone()
+        if exists:
+            return True
+
         try:
-            yield conn
-        finally:
-            conn.close()
+            # Also indexes any devices recorded before the index existed
+            conn.executescript(SQL_CREATE_DEVICES_FTS)
+            return True
+        except sqlite3.OperationalError as e:
+            self.logger.warning(f"Full-text search unavailable, using LIKE: {e}")
+            return False
+
+    @contextmanager
+    def get_connection(self, readonly: bool = False):
+        """Borrow a pooled connection; writes share one connection under a lock"""
+        if readonly:
+            conn = self._readers.get()
+            try:
+                yield conn
+            finally:
+                self._readers.put(conn)
+        else:
+            with self._writer_lock:
+                try:
+                    yield self._writer
+                finally:
+                    # Never hand a half-finished transaction to the next writer
+                    if self._writer.in_transaction:
+                        self._writer.rollback()
+                    self._invalidate_cache()
+
+    def _cached_query(self, key: tuple, loader: Callable, *args):
+        """Serve a read query from the short-lived cache, loading it on a miss"""
+        now = time.monotonic()
+        with self._cache_lock:
+            entry = self._query_cache.get(key)
+            epoch = self.cache_epoch
+        if entry and entry[0] > now:
+            return list(entry[1])
+
+        result = loader(*args)
+        with self._cache_lock:
+            # Drop results that a concurrent write may have made stale
+            if epoch == self.cache_epoch:
+                if len(self._query_cache) >= QUERY_CACHE_SIZE:
+                    self._query_cache.clear()
+                self._query_cache[key] = (now + QUERY_CACHE_TTL, result)
+        return list(result)
+
+    def current_epoch(self) -> int:
+        """cache_epoch, first bumped if anyone else has committed since the last check"""
+        with self._writer_lock:
+            data_version = self._writer.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self._invalidate_cache()
+        return self.cache_epoch
+
+    def _invalidate_cache(self):
+        """Forget cached query results after a write"""
+        with self._cache_lock:
+            self._query_cache.clear()
+            self.cache_epoch += 1
+
+    def close(self):
+        """Close all pooled connections"""
+        with self._writer_lock:
+            self._writer.close()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+
+    @staticmethod
+    def _configure_connection(conn: sqlite3.Connection):
+        """Apply the per-connection performance PRAGMAs"""
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
 
     def add_device(self, device: DeviceRecord) -> int:
         """Add or update a device record, return device ID"""
         try:
             with self.get_connection() as conn:
-                cursor = conn.cursor()
-
-                # Check if device already exists
-                cursor.execute("""
-                    SELECT id FROM devices
-                    WHERE vendor_id = ? AND product_id = ? AND serial_number = ?
-                """, (device.vendor_id, device.product_id, device.serial_number))
-
-                existing = cursor.fetchone()
-
-                if existing:
-                    # Update existing device
-                    device_id = existing['id']
-                    cursor.execute("""
-                        UPDATE devices SET
-                            last_seen = ?, port_number = ?, device_type = ?,
-                            manufacturer = ?, product_name = ?
-                        WHERE id = ?
-                    """, (
-                        device.last_seen, device.port_number, device.device_type,
-                        device.manufacturer, device.product_name, device_id
-                    ))
-                else:
-                    # Insert new device
-                    cursor.execute("""
-                        INSERT INTO devices
-                        (vendor_id, product_id, device_type, serial_number, manufacturer,
-                         product_name, port_number, first_seen, last_seen)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        device.vendor_id, device.product_id, device.device_type,
-                        device.serial_number, device.manufacturer, device.product_name,
-                        device.port_number, device.first_seen, device.last_seen
-                    ))
-                    device_id = cursor.lastrowid
-
+                device_id = self._upsert_device(conn.cursor(), device)
                 conn.commit()
-                self.logger.debug(f"Added/updated device {device_id}: {device.device_type}")
+                self.logger.debug("Added/updated device %s: %s", device_id, device.device_type)
                 return device_id
 
         except Exception as e:
             self.logger.error(f"Failed to add device: {e}")
             raise
 
+    def add_devices(self, devices: List[DeviceRecord]) -> List[int]:
+        """Add or update several device records in one transaction, return device IDs"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                device_ids = [self._upsert_device(cursor, device) for device in devices]
+                conn.commit()
+
+                # Let the query planner see the new row distribution
+                conn.execute("PRAGMA optimize")
+                self.logger.debug("Added/updated %d devices", len(device_ids))
+                return device_ids
+
+        except Exception as e:
+            self.logger.error(f"Failed to add devices: {e}")
+            raise
+
+    def _upsert_device(self, cursor: sqlite3.Cursor, device: DeviceRecord) -> int:
+        """Insert or update a device using an open cursor, return device ID"""
+        if SQLITE_HAS_UPSERT_RETURNING:
+            cursor.execute(SQL_UPSERT_DEVICE, (
+                device.vendor_id, device.product_id, device.device_type,
+                device.serial_number, device.manufacturer, device.product_name,
+                device.port_number, device.first_seen, device.last_seen
+            ))
+            return cursor.fetchone()['id']
+
+        # Check if device already exists
+        cursor.execute(SQL_SELECT_DEVICE_ID, (device.vendor_id, device.product_id, device.serial_number))
+
+        existing = cursor.fetchone()
+
+        if existing:
+            # Update existing device
+            device_id = existing['id']
+            cursor.execute(SQL_UPDATE_DEVICE, (
+                device.last_seen, device.port_number, device.device_type,
+                device.manufacturer, device.product_name, device_id
+            ))
+        else:
+            # Insert new device
+            cursor.execute(SQL_INSERT_DEVICE, (
+                device.vendor_id, device.product_id, device.device_type,
+                device.serial_number, device.manufacturer, device.product_name,
+                device.port_number, device.first_seen, device.last_seen
+            ))
+            device_id = cursor.lastrowid
+
+        return device_id
+
     def get_device_by_serial(self, serial_number: str) -> Optional[DeviceRecord]:
         """Get device by serial number"""
         try:
-            with self.get_connection() as conn:
+            with self.get_connection(readonly=True) as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT * FROM devices WHERE serial_number = ?", (serial_number,))
+                cursor.execute(SQL_DEVICE_BY_SERIAL, (serial_number,))
                 row = cursor.fetchone()
 
                 if row:
@@ -253,28 +629,37 @@ class DeviceDatabase:
     def get_devices_by_type(self, device_type: str) -> List[DeviceRecord]:
         """Get all devices of a specific type"""
         try:
-            with self.get_connection() as conn:
+            with self.get_connection(readonly=True) as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT * FROM devices WHERE device_type LIKE ? ORDER BY last_seen DESC",
-                             (f"%{device_type}%",))
-                rows = cursor.fetchall()
-
-                return [self._row_to_device_record(row) for row in rows]
+                cursor.execute(SQL_DEVICES_BY_TYPE, (f"%{device_type}%",))
+                return [self._row_to_device_record(row) for row in cursor]
 
         except Exception as e:
             self.logger.error(f"Failed to get devices by type: {e}")
             return []
 
+    def get_recent_devices(self, limit: int = 20) -> List[DeviceRecord]:
+        """Get the most recently seen devices"""
+        try:
+            return self._cached_query(('recent', limit), self._query_recent_devices, limit)
+
+        except Exception as e:
+            self.logger.error(f"Failed to get recent devices: {e}")
+            return []
+
+    def _query_recent_devices(self, limit: int) -> List[DeviceRecord]:
+        with self.get_connection(readonly=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute(SQL_RECENT_DEVICES, (limit,))
+
+            return [self._row_to_device_record(row) for row in cursor]
+
     def get_device_by_port(self, port_number: int) -> Optional[DeviceRecord]:
         """Get device currently connected to a port"""
         try:
-            with self.get_connection() as conn:
+            with self.get_connection(readonly=True) as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT * FROM devices
-                    WHERE port_number = ?
-                    ORDER BY last_seen DESC LIMIT 1
-                """, (port_number,))
+                cursor.execute(SQL_DEVICE_BY_PORT, (port_number,))
                 row = cursor.fetchone()
 
                 if row:
@@ -285,6 +670,29 @@ class DeviceDatabase:
             self.logger.error(f"Failed to get device by port: {e}")
             return None
 
+    def get_devices_by_ports(self, port_numbers: List[int]) -> Dict[int, DeviceRecord]:
+        """Get the device most recently seen on each of several ports"""
+        if not port_numbers:
+            return {}
+
+        try:
+            with self.get_connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                placeholders = ",".join("?" * len(port_numbers))
+                cursor.execute(f"""
+                    SELECT * FROM devices
+                    WHERE port_number IN ({placeholders})
+                    ORDER BY last_seen ASC
+                """, tuple(port_numbers))
+
+                # Later rows are more recent and replace older ones
+                return {row['port_number']: self._row_to_device_record(row)
+                        for row in cursor}
+
+        except Exception as e:
+            self.logger.error(f"Failed to get devices by ports: {e}")
+            return {}
+
     def add_test_result(self, device_id: int, test_name: str, result: str,
                        duration: float = 0, error_message: str = None,
                        firmware_version: str = None, port_number: int = None):
@@ -293,61 +701,71 @@ class DeviceDatabase:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
 
-                # Add test history record
-                cursor.execute("""
-                    INSERT INTO test_history
-                    (device_id, test_name, test_result, duration_seconds, error_message,
-                     firmware_version, port_number)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (device_id, test_name, result, duration, error_message,
-                     firmware_version, port_number))
-
-                # Update device test statistics
-                cursor.execute("""
-                    UPDATE devices SET
-                        test_count = test_count + 1,
-                        last_test_result = ?,
-                        last_test_time = ?
-                    WHERE id = ?
-                """, (result, datetime.now(), device_id))
+                # Add test history record; the test_history_stats trigger
+                # updates the device's test statistics in the same statement
+                cursor.execute(SQL_INSERT_TEST_HISTORY, (
+                    device_id, test_name, result, duration, error_message,
+                    firmware_version, port_number
+                ))
 
                 conn.commit()
-                self.logger.debug(f"Added test result for device {device_id}: {test_name} = {result}")
+                self.logger.debug("Added test result for device %s: %s = %s", device_id, test_name, result)
 
         except Exception as e:
             self.logger.error(f"Failed to add test result: {e}")
             raise
 
-    def get_test_history(self, device_id: Optional[int] = None, limit: int = 100) -> List[Dict]:
-        """Get test history, optionally filtered by device"""
+    def add_test_results(self, records: List[TestRecord]):
+        """Add several test results in one transaction"""
+        if not records:
+            return
+
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
 
-                if device_id:
-                    cursor.execute("""
-                        SELECT th.*, d.device_type, d.serial_number
-                        FROM test_history th
-                        JOIN devices d ON th.device_id = d.id
-                        WHERE th.device_id = ?
-                        ORDER BY th.test_time DESC LIMIT ?
-                    """, (device_id, limit))
-                else:
-                    cursor.execute("""
-                        SELECT th.*, d.device_type, d.serial_number
-                        FROM test_history th
-                        JOIN devices d ON th.device_id = d.id
-                        ORDER BY th.test_time DESC LIMIT ?
-                    """, (limit,))
+                cursor.executemany(SQL_INSERT_TEST_HISTORY, [
+                    (r.device_id, r.test_name, r.result, r.duration, r.error_message,
+                     r.firmware_version, r.port_number)
+                    for r in records
+                ])
+
+                conn.commit()
+                self.logger.debug("Added %d test results", len(records))
 
-                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            self.logger.error(f"Failed to add test results: {e}")
+            raise
+
+    def get_test_history(self, device_id: Optional[int] = None, limit: int = 100) -> List[Dict]:
+        """Get test history, optionally filtered by device"""
+        try:
+            return self._cached_query(('history', device_id, limit),
+                                      self._query_test_history, device_id, limit)
 
         except Exception as e:
             self.logger.error(f"Failed to get test history: {e}")
             return []
 
+    def _query_test_history(self, device_id: Optional[int], limit: int) -> List[Dict]:
+        return list(self.iter_test_history(device_id, limit))
+
+    def iter_test_history(self, device_id: Optional[int] = None, limit: int = 100) -> Iterator[Dict]:
+        """Yield test history rows as SQLite produces them, bypassing the query cache"""
+        with self.get_connection(readonly=True) as conn:
+            cursor = conn.cursor()
+
+            if device_id:
+                cursor.execute(SQL_DEVICE_TEST_HISTORY, (device_id, limit))
+            else:
+                cursor.execute(SQL_TEST_HISTORY, (limit,))
+
+            for row in cursor:
+                yield dict(row)
+
     def _row_to_device_record(self, row: sqlite3.Row) -> DeviceRecord:
         """Convert database row to DeviceRecord"""
+        first_seen, last_seen, last_test_time = row['first_seen'], row['last_seen'], row['last_test_time']
         return DeviceRecord(
             id=row['id'],
             vendor_id=row['vendor_id'],
@@ -357,39 +775,46 @@ class DeviceDatabase:
             manufacturer=row['manufacturer'],
             product_name=row['product_name'],
             port_number=row['port_number'],
-            first_seen=datetime.fromisoformat(row['first_seen']) if row['first_seen'] else datetime.now(),
-            last_seen=datetime.fromisoformat(row['last_seen']) if row['last_seen'] else datetime.now(),
+            first_seen=_parse_timestamp(first_seen) if first_seen else datetime.now(),
+            last_seen=_parse_timestamp(last_seen) if last_seen else datetime.now(),
             firmware_version=row['firmware_version'],
             test_count=row['test_count'],
             last_test_result=row['last_test_result'],
-            last_test_time=datetime.fromisoformat(row['last_test_time']) if row['last_test_time'] else None,
+            last_test_time=_parse_timestamp(last_test_time) if last_test_time else None,
             notes=row['notes']
         )
 
-    def search_devices(self, query: str) -> List[DeviceRecord]:
-        """Search devices by various criteria"""
+    def search_devices(self, query: str, limit: Optional[int] = None) -> List[DeviceRecord]:
+        """Search devices by various criteria, most recently seen first"""
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-
-                # Search across multiple fields
-                search_pattern = f"%{query}%"
-                cursor.execute("""
-                    SELECT * FROM devices
-                    WHERE device_type LIKE ? OR
-                          manufacturer LIKE ? OR
-                          product_name LIKE ? OR
-                          serial_number LIKE ? OR
-                          notes LIKE ?
-                    ORDER BY last_seen DESC
-                """, (search_pattern, search_pattern, search_pattern, search_pattern, search_pattern))
-
-                return [self._row_to_device_record(row) for row in cursor.fetchall()]
+            return self._cached_query(('search', query, limit), self._query_search_devices, query, limit)
 
         except Exception as e:
             self.logger.error(f"Failed to search devices: {e}")
             return []
 
+    def _query_search_devices(self, query: str, limit: Optional[int]) -> List[DeviceRecord]:
+        # SQLite treats a negative LIMIT as no limit
+        row_limit = -1 if limit is None else limit
+
+        with self.get_connection(readonly=True) as conn:
+            cursor = conn.cursor()
+
+            # Trigrams need at least three characters to match
+            if self.fts_enabled and len(query) >= 3:
+                phrase = '"' + query.replace('"', '""') + '"'
+                cursor.execute(SQL_SEARCH_DEVICES_FTS, (phrase, row_limit))
+            else:
+                cursor.execute(SQL_SEARCH_DEVICES, (f"%{query}%", row_limit))
+
+            # Convert rows as the cursor yields them rather than after fetchall()
+            return [self._row_to_device_record(row) for row in cursor]
+
+
+# Seconds send_command waits for the hub's reply when one is requested
+RESPONSE_TIMEOUT = 0.5
+RESPONSE_QUEUE_SIZE = 64
+
 
 class HubController:
     """Core hub control functionality with WebSocket communication"""
@@ -400,8 +825,12 @@ class HubController:
         self.config = config or {}
         self.ws = None
         self.connected = False
-        self.response_queue = asyncio.Queue()
+        # Filled from the WebSocket thread, so it must be a thread-safe queue
+        self.response_queue = queue.Queue(maxsize=RESPONSE_QUEUE_SIZE)
+        self._connected_event = threading.Event()
         self.hub_status = {}
+        # Bumped whenever hub_status or the connection state changes
+        self.status_epoch = 0
         self.device_db = DeviceDatabase()
         self.logger = logging.getLogger(f"{__name__}.HubController")
         self.callbacks = []
@@ -415,10 +844,28 @@ class HubController:
                 ports=[PortStatus(port_number=hub_num * 4 - 4 + i + 1) for i in range(4)]
             )
 
+        # The set of hubs never changes, so one read-only view serves every
+        # status read without copying the dict
+        self._hub_status_view = MappingProxyType(self.hub_status)
+
+        # Direct port number -> PortStatus lookup, shared with hub_status
+        self._port_index: Dict[int, PortStatus] = {
+            port.port_number: port
+            for hub in self.hub_status.values() for port in hub.ports
+        }
+
     def add_callback(self, callback: Callable):
         """Add a callback for hub events"""
         self.callbacks.append(callback)
 
+    def _notify(self, event: str, data: Any = None):
+        """Pass an event to every registered callback"""
+        for callback in self.callbacks:
+            try:
+                callback(event, data)
+            except Exception as e:
+                self.logger.error(f"Error in callback: {e}")
+
     def connect(self) -> bool:
         """Connect to USBFlashHub WebSocket"""
         try:
@@ -439,11 +886,9 @@ class HubController:
             self.ws_thread.start()
 
             # Wait for connection
-            for _ in range(50):  # 5 second timeout
-                if self.connected:
-                    self._refresh_status()
-                    return True
-                time.sleep(0.1)
+            if self._connected_event.wait(timeout=5.0):
+                self._refresh_status()
+                return True
 
             return False
 
@@ -456,27 +901,33 @@ class HubController:
         if self.ws:
             self.ws.close()
             self.connected = False
+            self.status_epoch += 1
 
     def _on_open(self, ws):
         """WebSocket connection opened"""
         self.connected = True
+        self.status_epoch += 1
+        self._connected_event.set()
         self.logger.info("Connected to USBFlashHub")
+        self._notify('connected')
 
     def _on_message(self, ws, message):
         """Handle incoming WebSocket message"""
         try:
-            data = json.loads(message)
-            self.logger.debug(f"Received: {message}")
+            data = orjson.loads(message) if ORJSON_AVAILABLE else json.loads(message)
+            self.logger.debug("Received: %s", message)
 
             # Update internal state based on message
             self._process_status_update(data)
 
+            # Hand the message to a send_command waiting for a reply
+            try:
+                self.response_queue.put_nowait(data)
+            except queue.Full:
+                pass  # Nobody is waiting for a reply
+
             # Notify callbacks
-            for callback in self.callbacks:
-                try:
-                    callback('message', data)
-                except Exception as e:
-                    self.logger.error(f"Error in callback: {e}")
+            self._notify('message', data)
 
         except Exception as e:
             self.logger.error(f"Error handling message: {e}")
@@ -488,7 +939,10 @@ class HubController:
     def _on_close(self, ws, close_status_code, close_msg):
         """WebSocket connection closed"""
         self.connected = False
+        self.status_epoch += 1
+        self._connected_event.clear()
         self.logger.info("Disconnected from USBFlashHub")
+        self._notify('disconnected')
 
     def send_command(self, command: Dict[str, Any], wait_for_response: bool = False) -> Optional[Dict[str, Any]]:
         """Send command to USBFlashHub"""
@@ -497,12 +951,21 @@ class HubController:
             return None
 
         try:
-            cmd_json = json.dumps(command)
-            self.logger.debug(f"Sending command: {cmd_json}")
+            if wait_for_response:
+                # Discard status frames that arrived before this command
+                while not self.response_queue.empty():
+                    self.response_queue.get_nowait()
+
+            # websocket-client sends bytes in a text frame just like str
+            cmd_json = orjson.dumps(command) if ORJSON_AVAILABLE else json.dumps(command)
+            self.logger.debug("Sending command: %s", cmd_json)
             self.ws.send(cmd_json)
 
             if wait_for_response:
-                time.sleep(0.2)  # Give time for response
+                try:
+                    return self.response_queue.get(timeout=RESPONSE_TIMEOUT)
+                except queue.Empty:
+                    self.logger.warning(f"No response to command: {cmd_json}")
 
             return {"status": "sent"}
 
@@ -528,11 +991,28 @@ class HubController:
 
         if success:
             # Update local status
-            hub_num = ((port - 1) // 4) + 1
-            port_idx = (port - 1) % 4
-            if hub_num in self.hub_status:
-                self.hub_status[hub_num].ports[port_idx].power_state = power_level
-                self.hub_status[hub_num].ports[port_idx].last_activity = datetime.now()
+            port_status = self._port_index.get(port)
+            if port_status:
+                port_status.power_state = power_level
+                port_status.last_activity = datetime.now()
+                self.status_epoch += 1
+                self._notify('port', port_status)
+
+        return success
+
+    def power_ports_batch(self, port_levels: List[Tuple[int, str]], spacing: float = 0.0) -> bool:
+        """Pipeline power commands for several ports without waiting between them
+
+        The firmware handles one JSON command per WebSocket frame, so all frames
+        are queued back-to-back on the open connection. ``spacing`` is an optional
+        gap between frames for hubs that need time to settle inrush current.
+        """
+        success = True
+        for i, (port, power_level) in enumerate(port_levels):
+            if i and spacing > 0:
+                time.sleep(spacing)
+            if not self.power_port(port, power_level):
+                success = False
 
         return success
 
@@ -591,19 +1071,54 @@ class HubController:
             self.logger.warning(f"Unknown device type for bootloader: {device_type}")
             return False
 
-    def get_hub_status(self) -> Dict[int, HubStatus]:
-        """Get current hub status"""
-        return self.hub_status.copy()
+    def enter_bootloader_by_power(self, ports: List[int], off_time: float = 0.05) -> bool:
+        """Power-cycle ports with the boot pin held so devices start in their bootloader"""
+        self.logger.info(f"Power-cycling ports {ports} into bootloader mode")
+
+        if not self.set_boot_pin(True):
+            return False
+
+        try:
+            if not self.power_ports_batch([(port, "off") for port in ports]):
+                return False
+            time.sleep(off_time)
+            if not self.power_ports_batch([(port, "high") for port in ports]):
+                return False
+            time.sleep(0.1)  # Boot straps are sampled as the chip leaves reset
+            return True
+        finally:
+            self.set_boot_pin(False)
+
+    def get_hub_status(self) -> Mapping[int, HubStatus]:
+        """Get current hub status as a read-only view"""
+        return self._hub_status_view
 
     def get_port_status(self, port: int) -> Optional[PortStatus]:
         """Get status for a specific port"""
-        hub_num = ((port - 1) // 4) + 1
-        port_idx = (port - 1) % 4
+        return self._port_index.get(port)
 
-        if hub_num in self.hub_status:
-            return self.hub_status[hub_num].ports[port_idx]
 
-        return None
+# CLI argument patterns, matched once per command instead of split + int()
+POWER_ARGS_PATTERN = re.compile(r'\s*(\d+)\s+(off|low|high)\s*', re.IGNORECASE)
+POWER_CYCLE_ARGS_PATTERN = re.compile(r'\s*(\d+)(?:\s+(\d+(?:\.\d*)?|\.\d+))?\s*')
+BOOTLOADER_ARGS_PATTERN = re.compile(r'\s*(\d+)(?:\s+(\S+))?\s*')
+DEVICES_PORT_PATTERN = re.compile(r'port:(\d+)')
+# Rows shown by the devices command; the query stops after this many
+DEVICE_LIST_LIMIT = 20
+
+SCRIPT_DIR = Path("/home/bruce/Arduino/USBFlashHub/agents/automation_scripts")
+# Seconds an automation script may run before it is stopped
+SCRIPT_TIMEOUT = 300
+# Long-running scripts (and the one with worker processes) keep their own
+# interpreter, where the timeout really kills them
+SUBPROCESS_SCRIPTS = frozenset({"program_all_esp32", "device_inventory"})
+# In-process scripts live under this sys.modules prefix, so a script can't
+# shadow a real module of the same name
+SCRIPT_MODULE_PREFIX = "usbflashhub_scripts."
+
+
+class _ScriptTimeout(BaseException):
+    """Raised by SIGALRM inside a script; not an Exception, so scripts can't swallow it"""
 
 
 class CLIInterface(cmd.Cmd):
@@ -624,28 +1139,30 @@ Type 'help' for available commands or 'quit' to exit.
         super().__init__()
         self.hub = hub_controller
         self.logger = logging.getLogger(f"{__name__}.CLIInterface")
+        # script name -> (file mtime, loaded module)
+        self._script_cache = {}
+        # (directory mtime, script names) from the last listing
+        self._script_list = (None, [])
 
     # Power control commands
     def do_power(self, args):
         """Power control: power <port> <level>
         Examples: power 5 high, power 3 off, power 1 low"""
         try:
-            parts = args.split()
-            if len(parts) != 2:
+            match = POWER_ARGS_PATTERN.fullmatch(args)
+            if not match:
                 print("Usage: power <port> <level>")
                 print("Levels: off, low, high")
                 return
 
-            port = int(parts[0])
-            level = parts[1]
+            port = int(match.group(1))
+            level = match.group(2).lower()
 
             if self.hub.power_port(port, level):
                 print(f"✓ Port {port} power set to {level}")
             else:
                 print(f"✗ Failed to set port {port} power")
 
-        except ValueError:
-            print("Invalid port number")
         except Exception as e:
             print(f"Error: {e}")
 
@@ -653,21 +1170,19 @@ Type 'help' for available commands or 'quit' to exit.
         """Power cycle a port: power-cycle <port> [off_time]
         Example: power-cycle 5, power-cycle 3 2.0"""
         try:
-            parts = args.split()
-            if len(parts) < 1:
+            match = POWER_CYCLE_ARGS_PATTERN.fullmatch(args)
+            if not match:
                 print("Usage: power-cycle <port> [off_time_seconds]")
                 return
 
-            port = int(parts[0])
-            off_time = float(parts[1]) if len(parts) > 1 else 1.0
+            port = int(match.group(1))
+            off_time = float(match.group(2)) if match.group(2) else 1.0
 
             if self.hub.power_cycle_port(port, off_time):
                 print(f"✓ Power cycled port {port}")
             else:
                 print(f"✗ Failed to power cycle port {port}")
 
-        except ValueError:
-            print("Invalid port number or off time")
         except Exception as e:
             print(f"Error: {e}")
 
@@ -682,21 +1197,19 @@ Type 'help' for available commands or 'quit' to exit.
         """Enter bootloader mode: bootloader <port> [device_type]
         Examples: bootloader 5, bootloader 3 STM32"""
         try:
-            parts = args.split()
-            if len(parts) < 1:
+            match = BOOTLOADER_ARGS_PATTERN.fullmatch(args)
+            if not match:
                 print("Usage: bootloader <port> [device_type]")
                 return
 
-            port = int(parts[0])
-            device_type = parts[1] if len(parts) > 1 else "ESP32"
+            port = int(match.group(1))
+            device_type = match.group(2) or "ESP32"
 
             if self.hub.enter_bootloader_mode(port, device_type):
                 print(f"✓ Entered bootloader mode for {device_type} on port {port}")
             else:
                 print(f"✗ Failed to enter bootloader mode on port {port}")
 
-        except ValueError:
-            print("Invalid port number")
         except Exception as e:
             print(f"Error: {e}")
 
@@ -758,17 +1271,17 @@ Type 'help' for available commands or 'quit' to exit.
         """List tracked devices: devices [filter]
         Examples: devices, devices ESP32, devices port:5"""
         devices = []
+        port_match = DEVICES_PORT_PATTERN.fullmatch(args)
 
         if not args:
-            # Get all recent devices
-            devices = self.hub.device_db.search_devices("")
-        elif args.startswith("port:"):
-            port_num = int(args[5:])
-            device = self.hub.device_db.get_device_by_port(port_num)
+            # Get the recent devices the listing shows
+            devices = self.hub.device_db.get_recent_devices(DEVICE_LIST_LIMIT)
+        elif port_match:
+            device = self.hub.device_db.get_device_by_port(int(port_match.group(1)))
             if device:
                 devices = [device]
         else:
-            devices = self.hub.device_db.search_devices(args)
+            devices = self.hub.device_db.search_devices(args, limit=DEVICE_LIST_LIMIT)
 
         if not devices:
             print("No devices found")
@@ -783,14 +1296,14 @@ Type 'help' for available commands or 'quit' to exit.
         """Plain text device listing"""
         print(f"\nFound {len(devices)} devices:")
         print("-" * 80)
-        for device in devices[:20]:  # Limit to 20 devices
-            print(f"ID: {device.id}")
-            print(f"  Type: {device.device_type}")
-            print(f"  Serial: {device.serial_number}")
-            print(f"  Port: {device.port_number}")
-            print(f"  Last seen: {device.last_seen}")
-            print(f"  Tests: {device.test_count} (last: {device.last_test_result})")
-            print()
+        for device in devices:
+            # One formatted write per device rather than one per line
+            print(f"ID: {device.id}\n"
+                  f"  Type: {device.device_type}\n"
+                  f"  Serial: {device.serial_number}\n"
+                  f"  Port: {device.port_number}\n"
+                  f"  Last seen: {device.last_seen}\n"
+                  f"  Tests: {device.test_count} (last: {device.last_test_result})\n")
 
     def _devices_rich(self, devices: List[DeviceRecord]):
         """Rich formatted device listing"""
@@ -804,7 +1317,7 @@ Type 'help' for available commands or 'quit' to exit.
         table.add_column("Last Seen", style="blue")
         table.add_column("Tests", style="white")
 
-        for device in devices[:20]:  # Limit to 20 devices
+        for device in devices:
             last_seen = device.last_seen.strftime("%m-%d %H:%M") if device.last_seen else "Unknown"
             test_info = f"{device.test_count} ({device.last_test_result})" if device.test_count > 0 else "0"
 
@@ -847,14 +1360,11 @@ Type 'help' for available commands or 'quit' to exit.
         print(f"\nTest History ({len(history)} entries):")
         print("-" * 80)
         for test in history:
-            print(f"Device: {test['device_type']} ({test['serial_number']})")
-            print(f"  Test: {test['test_name']} - {test['test_result']}")
-            print(f"  Time: {test['test_time']}")
-            if test['duration_seconds']:
-                print(f"  Duration: {test['duration_seconds']:.1f}s")
-            if test['error_message']:
-                print(f"  Error: {test['error_message']}")
-            print()
+            duration = f"\n  Duration: {test['duration_seconds']:.1f}s" if test['duration_seconds'] else ""
+            error = f"\n  Error: {test['error_message']}" if test['error_message'] else ""
+            print(f"Device: {test['device_type']} ({test['serial_number']})\n"
+                  f"  Test: {test['test_name']} - {test['test_result']}\n"
+                  f"  Time: {test['test_time']}{duration}{error}\n")
 
     def _test_history_rich(self, history: List[Dict]):
         """Rich formatted test history"""
@@ -893,7 +1403,7 @@ Type 'help' for available commands or 'quit' to exit.
         script_name = parts[0]
         script_args = parts[1:] if len(parts) > 1 else []
 
-        script_path = Path("/home/bruce/Arduino/USBFlashHub/agents/automation_scripts") / f"{script_name}.py"
+        script_path = SCRIPT_DIR / f"{script_name}.py"
 
         if not script_path.exists():
             print(f"Script not found: {script_name}")
@@ -901,34 +1411,140 @@ Type 'help' for available commands or 'quit' to exit.
             return
 
         try:
-            cmd = [sys.executable, str(script_path)] + script_args
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+            module = None
+            if script_name not in SUBPROCESS_SCRIPTS:
+                try:
+                    module = self._load_script(script_name, script_path)
+                except ImportError as e:
+                    self.logger.debug("Running %s in a subprocess: %s", script_name, e)
+
+            with self._script_signals(in_process=module is not None):
+                if module is None:
+                    returncode, stdout, stderr = self._run_script_subprocess(script_path, script_args)
+                else:
+                    returncode, stdout, stderr = self._run_script_in_process(module, script_path, script_args)
 
             print(f"Script output:")
-            print(result.stdout)
-            if result.stderr:
+            print(stdout)
+            if stderr:
                 print(f"Errors:")
-                print(result.stderr)
+                print(stderr)
 
-            if result.returncode == 0:
+            if returncode == 0:
                 print("✓ Script completed successfully")
             else:
-                print(f"✗ Script failed with exit code {result.returncode}")
+                print(f"✗ Script failed with exit code {returncode}")
 
-        except subprocess.TimeoutExpired:
+        except (subprocess.TimeoutExpired, _ScriptTimeout):
             print("✗ Script timed out")
+        except KeyboardInterrupt:
+            print("✗ Script interrupted")
         except Exception as e:
             print(f"Error running script: {e}")
 
+    @contextmanager
+    def _script_signals(self, in_process: bool):
+        """Route Ctrl+C to the running script, and time out in-process scripts
+
+        Ctrl+C raises KeyboardInterrupt instead of shutting the CLI down;
+        SIGALRM raises _ScriptTimeout after SCRIPT_TIMEOUT. Handlers can only
+        be changed on the main thread, which is where the CLI runs.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+
+        saved_sigint = signal.signal(signal.SIGINT, signal.default_int_handler)
+        use_alarm = in_process and hasattr(signal, 'SIGALRM')
+        if use_alarm:
+            def on_timeout(signum, frame):
+                raise _ScriptTimeout(f"Script exceeded {SCRIPT_TIMEOUT}s")
+            saved_alarm = signal.signal(signal.SIGALRM, on_timeout)
+            signal.alarm(SCRIPT_TIMEOUT)
+
+        try:
+            yield
+        finally:
+            if use_alarm:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, saved_alarm)
+            signal.signal(signal.SIGINT, saved_sigint)
+
+    def _load_script(self, script_name: str, script_path: Path):
+        """Import an automation script once, reloading it only when the file changes"""
+        mtime = script_path.stat().st_mtime
+        cached = self._script_cache.get(script_name)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        module_name = SCRIPT_MODULE_PREFIX + script_name
+        spec = importlib.util.spec_from_file_location(module_name, script_path)
+        if spec is None or spec.loader is None:
+            raise ImportError(f"Cannot load {script_path}")
+
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            sys.modules.pop(module_name, None)
+            raise
+
+        if not callable(getattr(module, 'main', None)):
+            raise ImportError(f"{script_name} has no main()")
+
+        self._script_cache[script_name] = (mtime, module)
+        return module
+
+    def _run_script_in_process(self, module, script_path: Path, script_args: List[str]) -> Tuple[int, str, str]:
+        """Call a loaded script's main() with its own argv and captured output"""
+        stdout, stderr = io.StringIO(), io.StringIO()
+        saved_argv = sys.argv
+        sys.argv = [str(script_path)] + script_args
+
+        try:
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                try:
+                    result = module.main()
+                except SystemExit as e:
+                    # Only the script raises this: _script_signals keeps the
+                    # CLI's exiting SIGINT handler out of the way
+                    result = e.code
+        finally:
+            sys.argv = saved_argv
+
+        # Same mapping as sys.exit(main()) in a subprocess
+        if result is None:
+            returncode = 0
+        elif isinstance(result, int):
+            returncode = int(result)
+        else:
+            returncode = 1
+        return returncode, stdout.getvalue(), stderr.getvalue()
+
+    def _run_script_subprocess(self, script_path: Path, script_args: List[str]) -> Tuple[int, str, str]:
+        """Run a script in a fresh interpreter (long-running or not importable)"""
+        cmd = [sys.executable, str(script_path)] + script_args
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=SCRIPT_TIMEOUT)
+        return result.returncode, result.stdout, result.stderr
+
     def _list_scripts(self):
         """List available automation scripts"""
-        script_dir = Path("/home/bruce/Arduino/USBFlashHub/agents/automation_scripts")
-
-        if not script_dir.exists():
+        try:
+            mtime = SCRIPT_DIR.stat().st_mtime
+        except OSError:
             print("No automation scripts directory found")
             return
 
-        scripts = list(script_dir.glob("*.py"))
+        # Adding or removing a script changes the directory mtime
+        cached_mtime, scripts = self._script_list
+        if cached_mtime != mtime:
+            with os.scandir(SCRIPT_DIR) as entries:
+                scripts = sorted(
+                    entry.name[:-3] for entry in entries
+                    if entry.name.endswith('.py') and not entry.name.startswith('_') and entry.is_file()
+                )
+            self._script_list = (mtime, scripts)
 
         if not scripts:
             print("No automation scripts found")
@@ -936,7 +1552,7 @@ Type 'help' for available commands or 'quit' to exit.
 
         print("\nAvailable automation scripts:")
         for script in scripts:
-            print(f"  {script.stem}")
+            print(f"  {script}")
 
     # Control flow commands
     def do_connect(self, args):
@@ -972,10 +1588,57 @@ Type 'help' for available commands or 'quit' to exit.
 class Dashboard:
     """Terminal-based status dashboard using Rich"""
 
+    # Rows taken by the header/footer panes plus the table's own borders,
+    # title, column header and caption
+    HUB_TABLE_CHROME = 14
+    # Seconds between redraws with no hub events (keeps the clock ticking)
+    HEARTBEAT = 1.0
+    # Seconds to let a burst of events settle before redrawing once for all
+    COALESCE_DELAY = 0.05
+
     def __init__(self, hub_controller: HubController):
         self.hub = hub_controller
         self.running = False
         self.logger = logging.getLogger(f"{__name__}.Dashboard")
+        self.console = None
+        self._row_cache = {}
+        self._hub_rows = None
+        self._device_rows = None
+
+        # Power cells for the known states, shared by every row; color codes
+        # anything other than off as powered
+        self._power_texts = {
+            state: Text(state, style="red" if state == "off" else "green")
+            for state in ("off", "low", "high", "unknown")
+        }
+
+        # Set from the WebSocket thread whenever the hub reports a change
+        self._changed = threading.Event()
+        self.hub.add_callback(self._on_hub_event)
+
+        # The layout skeleton never changes; ticks only swap pane contents
+        if RICH_AVAILABLE:
+            self._build_layout()
+
+    def _build_layout(self):
+        """Create the layout skeleton and the panels that are updated in place"""
+        self._layout = Layout()
+        self._layout.split_column(
+            Layout(name="header", size=3),
+            Layout(name="body"),
+            Layout(name="footer", size=3)
+        )
+        self._layout["body"].split_row(
+            Layout(name="left"),
+            Layout(name="right")
+        )
+        self._left_pane = self._layout["left"]
+        self._right_pane = self._layout["right"]
+
+        self._header_panel = Panel("", style="bold blue")
+        self._footer_panel = Panel("", style="dim")
+        self._layout["header"].update(self._header_panel)
+        self._layout["footer"].update(self._footer_panel)
 
     def start(self):
         """Start the live dashboard"""
@@ -984,56 +1647,106 @@ class Dashboard:
             return
 
         self.running = True
-        console = Console()
+        self.console = Console()
 
-        with Live(self._generate_layout(), refresh_per_second=1, console=console) as live:
+        # Redraw when the hub reports a change, or on the heartbeat otherwise
+        with Live(self._refresh_layout(), auto_refresh=False, console=self.console) as live:
             try:
                 while self.running:
-                    live.update(self._generate_layout())
-                    time.sleep(1)
+                    if self._changed.wait(timeout=self.HEARTBEAT):
+                        time.sleep(self.COALESCE_DELAY)
+                        self._changed.clear()
+
+                    self._refresh_layout()
+                    live.refresh()
             except KeyboardInterrupt:
                 self.running = False
 
     def stop(self):
         """Stop the dashboard"""
         self.running = False
+        self._changed.set()
 
-    def _generate_layout(self):
-        """Generate the dashboard layout"""
-        layout = Layout()
+    def _on_hub_event(self, event: str, data: Any):
+        """Wake the redraw loop; the loop reads the new state itself"""
+        self._changed.set()
 
-        layout.split_column(
-            Layout(name="header", size=3),
-            Layout(name="body"),
-            Layout(name="footer", size=3)
+    def _refresh_layout(self):
+        """Update the contents of the dashboard panes in place"""
+        # Header
+        self._header_panel.renderable = (
+            f"USBFlashHub Control Dashboard - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
         )
 
-        layout["body"].split_row(
-            Layout(name="left"),
-            Layout(name="right")
+        # Hub status table, rebuilt only when a visible port changed
+        rows = self._visible_hub_rows()
+        if rows != self._hub_rows:
+            self._hub_rows = rows
+            self._left_pane.update(self._create_hub_status_panel(rows))
+
+        # Device list, rebuilt only when the recent devices changed
+        devices = self.hub.device_db.get_recent_devices(10)
+        device_rows = tuple(
+            (device.device_type, device.port_number, device.last_seen, device.test_count)
+            for device in devices
         )
+        if device_rows != self._device_rows:
+            self._device_rows = device_rows
+            self._right_pane.update(self._create_device_panel(devices))
 
-        # Header
-        layout["header"].update(Panel(
-            f"USBFlashHub Control Dashboard - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-            style="bold blue"
-        ))
+        # Footer
+        self._footer_panel.renderable = (
+            "Press Ctrl+C to exit | Connection: " + ("Connected" if self.hub.connected else "Disconnected")
+        )
 
-        # Hub status table
-        layout["left"].update(self._create_hub_status_panel())
+        return self._layout
 
-        # Device list
-        layout["right"].update(self._create_device_panel())
+    def _visible_hub_rows(self) -> Tuple[tuple, ...]:
+        """Rendered hub status rows that fit the terminal, re-rendering only changed ports"""
+        rows = []
 
-        # Footer
-        layout["footer"].update(Panel(
-            "Press Ctrl+C to exit | Connection: " + ("Connected" if self.hub.connected else "Disconnected"),
-            style="dim"
-        ))
+        for hub_num, hub in self.hub.get_hub_status().items():
+            for i, port in enumerate(hub.ports):
+                key = (hub_num, port.port_number)
+                state = (
+                    i,
+                    port.power_state,
+                    port.device_info.device_type if port.device_info else None,
+                    port.last_activity
+                )
 
-        return layout
+                cached = self._row_cache.get(key)
+                if cached is None or cached[0] != state:
+                    cached = (state, self._render_port_row(hub_num, i, port))
+                    self._row_cache[key] = cached
+                rows.append(cached[1])
+
+        if self.console is not None:
+            visible = max(self.console.size.height - self.HUB_TABLE_CHROME, 1)
+            if len(rows) > visible:
+                del rows[visible:]
+
+        return tuple(rows)
+
+    def _render_port_row(self, hub_num: int, index: int, port: PortStatus) -> tuple:
+        """Render the table cells for one port"""
+        hub_display = f"Hub {hub_num}" if index == 0 else ""
+        device_display = port.device_info.device_type if port.device_info else "-"
+        activity = port.last_activity.strftime("%H:%M:%S") if port.last_activity else "-"
+
+        power = self._power_texts.get(port.power_state)
+        if power is None:
+            power = Text(port.power_state, style="green")
+
+        return (
+            hub_display,
+            str(port.port_number),
+            power,
+            device_display,
+            activity
+        )
 
-    def _create_hub_status_panel(self):
+    def _create_hub_status_panel(self, rows: Tuple[tuple, ...]):
         """Create hub status panel"""
         table = Table(title="Hub Status")
         table.add_column("Hub", style="cyan")
@@ -1042,30 +1755,17 @@ class Dashboard:
         table.add_column("Device", style="blue")
         table.add_column("Last Activity", style="dim")
 
-        hub_status = self.hub.get_hub_status()
-        for hub_num, hub in hub_status.items():
-            for i, port in enumerate(hub.ports):
-                hub_display = f"Hub {hub_num}" if i == 0 else ""
-                device_display = port.device_info.device_type if port.device_info else "-"
-                activity = port.last_activity.strftime("%H:%M:%S") if port.last_activity else "-"
-
-                # Color code power state
-                power_color = "green" if port.power_state != "off" else "red"
+        for row in rows:
+            table.add_row(*row)
 
-                table.add_row(
-                    hub_display,
-                    str(port.port_number),
-                    Text(port.power_state, style=power_color),
-                    device_display,
-                    activity
-                )
+        total_ports = len(self._row_cache)
+        if len(rows) < total_ports:
+            table.caption = f"Showing {len(rows)} of {total_ports} ports"
 
         return Panel(table, title="Hub Status", border_style="blue")
 
-    def _create_device_panel(self):
+    def _create_device_panel(self, devices: List[DeviceRecord]):
         """Create device panel"""
-        devices = self.hub.device_db.search_devices("")[:10]  # Last 10 devices
-
         if not devices:
             return Panel("No devices tracked", title="Recent Devices", border_style="green")
 
@@ -1089,6 +1789,10 @@ class Dashboard:
         return Panel(table, title="Recent Devices", border_style="green")
 
 
+# Worker threads serving REST requests concurrently
+API_THREADS = 8
+
+
 class RestAPIServer:
     """Optional REST API server for remote control"""
 
@@ -1101,9 +1805,33 @@ class RestAPIServer:
         self.app = Flask(__name__)
         CORS(self.app)
         self.logger = logging.getLogger(f"{__name__}.RestAPIServer")
+        # Keeps ETags from a previous server run from matching this one
+        self._etag_prefix = f"{int(time.time()):x}"
 
         self._setup_routes()
 
+    def _conditional_json(self, epoch: int, build: Callable, stream: bool = False,
+                          variant: tuple = ()):
+        """Reply 304 when the client already holds this version, else build the JSON
+
+        ``variant`` holds the query arguments the response depends on, so each
+        combination gets its own ETag. With ``stream`` the built value is
+        iterated and sent as a JSON array element by element instead of being
+        serialized up front.
+        """
+        etag = f"{self._etag_prefix}-{epoch}"
+        if variant:
+            digest = hashlib.blake2b(repr(variant).encode(), digest_size=8).hexdigest()
+            etag = f"{etag}-{digest}"
+        if request.if_none_match.contains(etag):
+            response = self.app.response_class(status=304)
+        elif stream:
+            response = self.app.response_class(_iter_json_array(build()), mimetype='application/json')
+        else:
+            response = self.app.response_class(_dumps_json(build()), mimetype='application/json')
+        response.set_etag(etag)
+        return response
+
     def _setup_routes(self):
         """Set up API routes"""
 
@@ -1111,9 +1839,9 @@ class RestAPIServer:
         def get_status():
             """Get hub status"""
             hub_status = self.hub.get_hub_status()
-            return jsonify({
+            return self._conditional_json(self.hub.status_epoch, lambda: {
                 "connected": self.hub.connected,
-                "hubs": {str(k): asdict(v) for k, v in hub_status.items()}
+                "hubs": {str(k): v for k, v in hub_status.items()}
             })
 
         @self.app.route('/api/port/<int:port>/power', methods=['POST'])
@@ -1159,8 +1887,15 @@ class RestAPIServer:
             query = request.args.get('q', '')
             limit = int(request.args.get('limit', 50))
 
-            devices = self.hub.device_db.search_devices(query)[:limit]
-            return jsonify([asdict(device) for device in devices])
+            def build():
+                if query:
+                    devices = self.hub.device_db.search_devices(query, limit)
+                else:
+                    devices = self.hub.device_db.get_recent_devices(limit)
+                return devices
+
+            return self._conditional_json(self.hub.device_db.current_epoch(), build,
+                                          variant=(query, limit))
 
         @self.app.route('/api/test-history', methods=['GET'])
         def get_test_history():
@@ -1169,13 +1904,22 @@ class RestAPIServer:
             limit = int(request.args.get('limit', 100))
 
             device_id = int(device_id) if device_id else None
-            history = self.hub.device_db.get_test_history(device_id, limit)
-            return jsonify(history)
+            # Rows are serialized as the cursor produces them
+            return self._conditional_json(
+                self.hub.device_db.current_epoch(),
+                lambda: self.hub.device_db.iter_test_history(device_id, limit),
+                stream=True,
+                variant=(device_id, limit)
+            )
 
     def start(self):
         """Start the API server"""
         self.logger.info(f"Starting REST API server on port {self.port}")
-        self.app.run(host='0.0.0.0', port=self.port, debug=False)
+        if WAITRESS_AVAILABLE:
+            serve(self.app, host='0.0.0.0', port=self.port, threads=API_THREADS)
+        else:
+            self.logger.warning("waitress not installed, using Flask's development server")
+            self.app.run(host='0.0.0.0', port=self.port, debug=False, threaded=True)
 
 
 def load_config(config_path: str) -> Dict:
@@ -1188,6 +1932,37 @@ def load_config(config_path: str) -> Dict:
         return {}
 
 
+PORT_RANGE_PATTERN = re.compile(r'\s*(\d+)\s*(?:-\s*(\d+)\s*)?')
+
+
+def parse_port_list(port_spec: str) -> List[int]:
+    """Parse port specification like '1,2,5-8' into sorted list of port numbers"""
+    return list(_parse_port_spec(port_spec))
+
+
+@lru_cache(maxsize=32)
+def _parse_port_spec(port_spec: str) -> Tuple[int, ...]:
+    """Parse a port specification into a cached tuple using an integer bitmap
+
+    Ports above the last hub port are dropped.
+    """
+    bits = 0
+
+    for part in port_spec.split(','):
+        match = PORT_RANGE_PATTERN.fullmatch(part)
+        if not match:
+            raise ValueError(f"Invalid port specification: {part!r}")
+
+        # Clipped to the hub's ports before the bitmap is built, so a huge
+        # range can't allocate a huge integer
+        start = int(match.group(1))
+        end = min(int(match.group(2) or start), ALL_PORTS[-1])
+        if end >= start:
+            bits |= ((1 << (end - start + 1)) - 1) << start
+
+    return tuple(port for port in range(bits.bit_length()) if bits >> port & 1)
+
+
 def signal_handler(sig, frame):
     """Handle Ctrl+C gracefully"""
     logger.info("Received interrupt signal, shutting down...")
@@ -14,58 +14,77 @@ Usage: This script is called by the testing agent after firmware is flashed.
 import serial
 import time
 import sys
+import re
+import os
 import logging
-import glob
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Blink-related keywords, matched case-insensitively in one pass over the output
+BLINK_KEYWORDS = [
+    'blink', 'led', 'on', 'off', 'toggle',
+    'HIGH', 'LOW', 'digitalWrite', 'delay',
+    'loop', 'setup'
+]
+# The lookahead reports keywords that overlap, like a per-keyword substring test
+BLINK_KEYWORDS_PATTERN = re.compile(
+    '(?=(' + '|'.join(re.escape(keyword) for keyword in BLINK_KEYWORDS) + '))',
+    re.IGNORECASE
+)
+
 def find_device_port():
     """Find the device serial port"""
-    # Common serial port patterns
-    patterns = ['/dev/ttyUSB*', '/dev/ttyACM*', '/dev/cu.usbserial*', '/dev/cu.usbmodem*']
+    # Common serial port name prefixes, in order of preference
+    prefixes = ('ttyUSB', 'ttyACM', 'cu.usbserial', 'cu.usbmodem')
+
+    # One directory scan instead of a glob per pattern
+    with os.scandir('/dev') as entries:
+        names = [entry.name for entry in entries if entry.name.startswith(prefixes)]
 
-    for pattern in patterns:
-        ports = glob.glob(pattern)
+    for prefix in prefixes:
+        ports = [name for name in names if name.startswith(prefix)]
         if ports:
             # Sort ports to get consistent selection
-            ports.sort()
-            return ports[0]  # Return first found port
+            return os.path.join('/dev', min(ports))
 
     return None
 
-def test_device_output(port_path, timeout=15):
-    """Test for device output indicating it's running"""
-    try:
-        logger.info(f"Connecting to device on {port_path}")
+def open_serial(port_path, baud=115200, timeout=3):
+    """Open the port with DTR/RTS released so opening it does not reset the board"""
+    ser = serial.serial_for_url(port_path, baud, timeout=timeout, do_not_open=True)
+    ser.dtr = False
+    ser.rts = False
+    ser.open()
+    return ser
 
+def test_device_output(ser, timeout=15):
+    """Test for device output, leaving the port at the first baud rate that works"""
+    try:
         # Try different baud rates common for microcontrollers
         baud_rates = [115200, 9600, 57600, 38400]
 
         for baud in baud_rates:
             try:
                 logger.info(f"Trying baud rate: {baud}")
-                ser = serial.Serial(port_path, baud, timeout=3)
-                time.sleep(2)  # Allow device to settle
+                # Reconfigures the open port rather than reopening it
+                ser.baudrate = baud
 
                 # Clear any existing data
                 ser.reset_input_buffer()
 
-                # Wait for output
-                start_time = time.time()
+                # Block until a line arrives instead of polling in_waiting
+                deadline = time.monotonic() + timeout
                 output_received = False
 
-                while time.time() - start_time < timeout:
-                    if ser.in_waiting > 0:
-                        data = ser.read(ser.in_waiting).decode('utf-8', errors='ignore')
-                        if data.strip():
-                            logger.info(f"Device output received: {data[:100]}...")
-                            output_received = True
-                            break
-                    time.sleep(0.5)
-
-                ser.close()
+                while (remaining := deadline - time.monotonic()) > 0:
+                    ser.timeout = remaining
+                    data = ser.read_until(b'\n', 4096).decode('utf-8', errors='ignore')
+                    if data.strip():
+                        logger.info(f"Device output received: {data[:100]}...")
+                        output_received = True
+                        break
 
                 if output_received:
                     logger.info(f"Device is producing output at {baud} baud")
@@ -85,42 +104,31 @@ def test_device_output(port_path, timeout=15):
         logger.error(f"Test error: {e}")
         return False
 
-def test_blink_pattern(port_path, timeout=10):
+def test_blink_pattern(ser, timeout=10):
     """Test for blink-related output patterns"""
     try:
-        logger.info(f"Testing for blink patterns on {port_path}")
-
-        ser = serial.Serial(port_path, 115200, timeout=timeout)
-        time.sleep(2)
+        logger.info(f"Testing for blink patterns on {ser.port}")
 
         # Clear buffer
         ser.reset_input_buffer()
 
-        # Collect output for analysis
-        start_time = time.time()
-        collected_output = ""
+        # Collect output for analysis, blocking until bytes arrive
+        deadline = time.monotonic() + timeout
+        chunks = []
 
-        while time.time() - start_time < timeout:
-            if ser.in_waiting > 0:
-                data = ser.read(ser.in_waiting).decode('utf-8', errors='ignore')
-                collected_output += data
+        while (remaining := deadline - time.monotonic()) > 0:
+            ser.timeout = remaining
+            data = ser.read(ser.in_waiting or 1)
+            chunks.append(data)
+            if data and logger.isEnabledFor(logging.DEBUG):
                 logger.debug(f"Received: {data}")
 
-            time.sleep(0.5)
-
-        ser.close()
+        # Join and decode once rather than growing a string per read
+        collected_output = b''.join(chunks).decode('utf-8', errors='ignore')
 
         # Look for blink-related keywords
-        blink_keywords = [
-            'blink', 'led', 'on', 'off', 'toggle',
-            'HIGH', 'LOW', 'digitalWrite', 'delay',
-            'loop', 'setup'
-        ]
-
-        found_keywords = []
-        for keyword in blink_keywords:
-            if keyword.lower() in collected_output.lower():
-                found_keywords.append(keyword)
+        matched = {match.group(1).lower() for match in BLINK_KEYWORDS_PATTERN.finditer(collected_output)}
+        found_keywords = [keyword for keyword in BLINK_KEYWORDS if keyword.lower() in matched]
 
         if found_keywords:
             logger.info(f"Found blink-related keywords: {found_keywords}")
@@ -133,13 +141,13 @@ def test_blink_pattern(port_path, timeout=10):
         logger.error(f"Blink pattern test error: {e}")
         return True  # Don't fail the test for this
 
-def test_device_responsiveness(port_path):
+def test_device_responsiveness(ser):
     """Test if device responds to input"""
     try:
-        logger.info(f"Testing device responsiveness on {port_path}")
+        logger.info(f"Testing device responsiveness on {ser.port}")
 
-        ser = serial.Serial(port_path, 115200, timeout=5)
-        time.sleep(2)
+        # Each command gets up to a second for the first reply line
+        ser.timeout = 1
 
         # Clear buffer
         ser.reset_input_buffer()
@@ -148,19 +156,15 @@ def test_device_responsiveness(port_path):
         test_commands = [b'\\n', b'\\r\\n', b'?\\n', b'help\\n', b'status\\n']
 
         for cmd in test_commands:
-            logger.debug(f"Sending: {cmd}")
+            logger.debug("Sending: %s", cmd)
             ser.write(cmd)
-            time.sleep(1)
 
             # Check for any response
-            if ser.in_waiting > 0:
-                response = ser.read_all().decode('utf-8', errors='ignore')
-                if response.strip():
-                    logger.info(f"Device responded to command: {response[:50]}...")
-                    ser.close()
-                    return True
+            response = ser.read_until(b'\n', 1024).decode('utf-8', errors='ignore')
+            if response.strip():
+                logger.info(f"Device responded to command: {response[:50]}...")
+                return True
 
-        ser.close()
         logger.info("Device does not respond to commands (normal for simple blink firmware)")
         return True  # Don't fail if device doesn't respond to commands
 
@@ -180,16 +184,27 @@ def main():
 
     logger.info(f"Found device port: {port}")
 
-    # Test basic device output
-    if not test_device_output(port):
-        logger.error("Device output test failed - device may not be running")
+    # One connection serves every test, so the board settles only once
+    try:
+        logger.info(f"Connecting to device on {port}")
+        ser = open_serial(port)
+    except serial.SerialException as e:
+        logger.error(f"Serial port error: {e}")
         return False
 
-    # Test for blink patterns
-    test_blink_pattern(port)
+    with ser:
+        time.sleep(2)  # Allow device to settle
+
+        # Test basic device output
+        if not test_device_output(ser):
+            logger.error("Device output test failed - device may not be running")
+            return False
+
+        # Test for blink patterns
+        test_blink_pattern(ser)
 
-    # Test device responsiveness
-    test_device_responsiveness(port)
+        # Test device responsiveness
+        test_device_responsiveness(ser)
 
     logger.info("Basic blink test completed successfully")
     return True
@@ -14,34 +14,50 @@ Usage: This script is called by the testing agent after firmware is flashed.
 import serial
 import time
 import sys
+import re
+import codecs
+import os
 import logging
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# WiFi-related responses from the firmware
+WIFI_INDICATORS_PATTERN = re.compile(r'WIFI|wifi|AP:|SSID|scan|connected')
+
 def find_esp32_port():
     """Find the ESP32 serial port"""
-    import glob
+    # Common ESP32 serial port name prefixes, in order of preference
+    prefixes = ('ttyUSB', 'ttyACM', 'cu.usbserial')
 
-    # Common ESP32 serial port patterns
-    patterns = ['/dev/ttyUSB*', '/dev/ttyACM*', '/dev/cu.usbserial*']
+    # One directory scan instead of a glob per pattern
+    with os.scandir('/dev') as entries:
+        names = [entry.name for entry in entries if entry.name.startswith(prefixes)]
 
-    for pattern in patterns:
-        ports = glob.glob(pattern)
+    for prefix in prefixes:
+        ports = [name for name in names if name.startswith(prefix)]
         if ports:
-            return ports[0]  # Return first found port
+            return os.path.join('/dev', min(ports))  # First port in sorted order
 
     return None
 
-def test_esp32_response(port_path, timeout=10):
+def open_serial(port_path, baud=115200, timeout=3):
+    """Open the port with DTR/RTS released so opening it does not reset the board"""
+    ser = serial.serial_for_url(port_path, baud, timeout=timeout, do_not_open=True)
+    ser.dtr = False
+    ser.rts = False
+    ser.open()
+    return ser
+
+def test_esp32_response(ser, timeout=10):
     """Test ESP32 device response"""
     try:
-        logger.info(f"Connecting to ESP32 on {port_path}")
+        logger.info(f"Testing ESP32 response on {ser.port}")
 
-        # Connect to ESP32
-        ser = serial.Serial(port_path, 115200, timeout=timeout)
-        time.sleep(2)  # Allow device to settle
+        # Each command gets up to a second for a reply line
+        ser.timeout = 1
+        deadline = time.monotonic() + timeout
 
         # Clear any existing data
         ser.reset_input_buffer()
@@ -54,12 +70,14 @@ def test_esp32_response(port_path, timeout=10):
         ]
 
         for cmd in test_commands:
+            if time.monotonic() >= deadline:
+                break
+
             logger.info(f"Sending command: {cmd}")
             ser.write(cmd)
-            time.sleep(1)
 
-            # Read response
-            response = ser.read_all().decode('utf-8', errors='ignore')
+            # Read response, returning as soon as a line arrives
+            response = ser.read_until(b'\n', 1024).decode('utf-8', errors='ignore')
             logger.info(f"Response: {response}")
 
             # Check for any response (device is alive)
@@ -76,17 +94,11 @@ def test_esp32_response(port_path, timeout=10):
     except Exception as e:
         logger.error(f"Test error: {e}")
         return False
-    finally:
-        if 'ser' in locals() and ser.is_open:
-            ser.close()
 
-def test_wifi_functionality(port_path, timeout=30):
+def test_wifi_functionality(ser, timeout=30):
     """Test WiFi functionality (if supported by firmware)"""
     try:
-        logger.info(f"Testing WiFi functionality on {port_path}")
-
-        ser = serial.Serial(port_path, 115200, timeout=timeout)
-        time.sleep(2)
+        logger.info(f"Testing WiFi functionality on {ser.port}")
 
         # Clear buffer
         ser.reset_input_buffer()
@@ -98,19 +110,36 @@ def test_wifi_functionality(port_path, timeout=30):
             b'AT+CWLAP\\n',  # AT command style
         ]
 
+        deadline = time.monotonic() + timeout
+
         for cmd in wifi_commands:
+            if time.monotonic() >= deadline:
+                break
+
             logger.info(f"Sending WiFi command: {cmd}")
             ser.write(cmd)
-            time.sleep(3)  # WiFi operations need more time
-
-            response = ser.read_all().decode('utf-8', errors='ignore')
-            logger.info(f"WiFi response: {response}")
 
-            # Look for WiFi-related responses
-            wifi_indicators = ['WIFI', 'wifi', 'AP:', 'SSID', 'scan', 'connected']
-            if any(indicator in response for indicator in wifi_indicators):
-                logger.info("WiFi functionality detected")
-                return True
+            # WiFi operations need more time, so read reply lines for up to
+            # 3 seconds but stop as soon as one looks WiFi-related
+            reply_deadline = min(time.monotonic() + 3, deadline)
+            lines = []
+            # Carries a multibyte character split across reads into the next one
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+            while (remaining := reply_deadline - time.monotonic()) > 0:
+                ser.timeout = remaining
+                data = ser.read_until(b'\n', 1024)
+                if not data:
+                    break
+                line = decoder.decode(data)
+                lines.append(line)
+
+                # Look for WiFi-related responses
+                if WIFI_INDICATORS_PATTERN.search(line):
+                    logger.info(f"WiFi response: {''.join(lines)}")
+                    logger.info("WiFi functionality detected")
+                    return True
+
+            logger.info(f"WiFi response: {''.join(lines)}")
 
         logger.info("No WiFi functionality detected (may be normal for test firmware)")
         return True  # Don't fail if WiFi not implemented in test firmware
@@ -118,9 +147,6 @@ def test_wifi_functionality(port_path, timeout=30):
     except Exception as e:
         logger.error(f"WiFi test error: {e}")
         return False
-    finally:
-        if 'ser' in locals() and ser.is_open:
-            ser.close()
 
 def main():
     """Main test function"""
@@ -134,15 +160,26 @@ def main():
 
     logger.info(f"Found ESP32 port: {port}")
 
-    # Test basic device response
-    if not test_esp32_response(port):
-        logger.error("ESP32 basic response test failed")
+    # One connection serves every test, so the board settles only once
+    try:
+        logger.info(f"Connecting to ESP32 on {port}")
+        ser = open_serial(port)
+    except serial.SerialException as e:
+        logger.error(f"Serial port error: {e}")
         return False
 
-    # Test WiFi functionality
-    if not test_wifi_functionality(port):
-        logger.error("ESP32 WiFi test failed")
-        return False
+    with ser:
+        time.sleep(2)  # Allow device to settle
+
+        # Test basic device response
+        if not test_esp32_response(ser):
+            logger.error("ESP32 basic response test failed")
+            return False
+
+        # Test WiFi functionality
+        if not test_wifi_functionality(ser):
+            logger.error("ESP32 WiFi test failed")
+            return False
 
     logger.info("ESP32 WiFi test completed successfully")
     return True
@@ -12,13 +12,19 @@ A comprehensive testing automation system for the USBFlashHub that:
 Author: Testing automation for USBFlashHub
 """
 
-import asyncio
+import atexit
 import json
 import logging
+import logging.handlers
 import time
 import subprocess
 import signal
 import sys
+import queue
+from collections import deque
+import io
+import pickle
+from concurrent.futures import ThreadPoolExecutor, wait
 from dataclasses import dataclass, field
 from typing import Dict, List, Optional, Any, Callable
 from pathlib import Path
@@ -28,17 +34,43 @@ import websocket
 import threading
 from datetime import datetime
 import re
+from operator import attrgetter
+from contextlib import nullcontext, redirect_stdout, redirect_stderr
+from types import MappingProxyType
+
+try:
+    import esptool
+    ESPTOOL_AVAILABLE = True
+except ImportError:
+    ESPTOOL_AVAILABLE = False
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/home/bruce/Arduino/USBFlashHub/agents/testing_agent.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_log_handlers = [
+    logging.FileHandler('/home/bruce/Arduino/USBFlashHub/agents/testing_agent.log'),
+    logging.StreamHandler(sys.stdout)
+]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+
+# Records are written by a listener thread, so slow disk or console I/O
+# never stalls the udev, WebSocket or device worker threads
+_log_queue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue, *_log_handlers)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# Plain message formatter: the listener's handlers add timestamp and level
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter())
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
 logger = logging.getLogger(__name__)
 
 
@@ -64,6 +96,15 @@ class TestStep:
     timeout: float = 30.0
     retry_count: int = 0
     success_criteria: Optional[str] = None
+    # Firmware image or test script from params, parsed once at rule load.
+    # Kept as written: symlinks and relative paths are followed at each use,
+    # so a repointed latest.bin is picked up even from the cached rules
+    path: Optional[Path] = field(default=None, init=False)
+
+    def __post_init__(self):
+        target = self.params.get("file" if self.action == "flash_firmware" else "script")
+        if target:
+            self.path = Path(target)
 
 
 @dataclass
@@ -77,6 +118,15 @@ class TestResult:
     end_time: datetime
     error_message: Optional[str] = None
     logs: List[str] = field(default_factory=list)
+    duration: float = field(init=False)
+
+    def __post_init__(self):
+        self.duration = (self.end_time - self.start_time).total_seconds()
+
+
+# Steps that drive hub-wide hardware: the BOOT/RESET lines are shared by
+# every port, and power steps may name a port other than the device's own
+SHARED_HARDWARE_ACTIONS = frozenset({"enter_bootloader", "reset_device", "power_on", "power_off"})
 
 
 class DeviceRule:
@@ -87,13 +137,32 @@ class DeviceRule:
         self.device_filter = device_filter
         self.steps = steps
 
+        # A misspelt key would otherwise just never match anything
+        unknown_keys = set(device_filter) - set(DeviceInfo.__dataclass_fields__)
+        if unknown_keys:
+            raise ValueError(f"Rule {name}: unknown device_filter keys: {', '.join(sorted(unknown_keys))}")
+
+        # Accessors and regexes built once here rather than on every device event
+        self._filter_compiled = [
+            (attrgetter(key), re.compile(str(pattern), re.IGNORECASE))
+            for key, pattern in device_filter.items()
+        ]
+
+        # A plain 4-digit vendor ID matches exactly what the regex would, so
+        # the engine can look the rule up by it instead of trying it on every device
+        vendor_id = str(device_filter.get('vendor_id', ''))
+        self.vendor_key = vendor_id.lower() if len(vendor_id) == 4 and re.escape(vendor_id) == vendor_id else None
+
+        # Such rules run one at a time across the hub, start to finish
+        self.uses_shared_hardware = any(step.action in SHARED_HARDWARE_ACTIONS for step in steps)
+
     def matches_device(self, device: DeviceInfo) -> bool:
         """Check if this rule applies to the given device"""
-        for key, pattern in self.device_filter.items():
-            device_value = getattr(device, key, None)
+        for get_value, pattern in self._filter_compiled:
+            device_value = get_value(device)
             if device_value is None:
                 return False
-            if not re.match(pattern, str(device_value), re.IGNORECASE):
+            if not pattern.match(str(device_value)):
                 return False
         return True
 
@@ -118,6 +187,11 @@ class DeviceRule:
         )
 
 
+# Seconds send_command waits for the hub's reply
+RESPONSE_TIMEOUT = 5.0
+RESPONSE_QUEUE_SIZE = 64
+
+
 class USBHubController:
     """WebSocket controller for USBFlashHub communication"""
 
@@ -126,7 +200,11 @@ class USBHubController:
         self.port = port
         self.ws = None
         self.connected = False
-        self.response_queue = asyncio.Queue()
+        # Filled from the WebSocket thread, so it must be a thread-safe queue
+        self.response_queue = queue.Queue(maxsize=RESPONSE_QUEUE_SIZE)
+        self._connected_event = threading.Event()
+        # Keeps a burst of frames from being interleaved with another sender's
+        self._send_lock = threading.Lock()
         self.logger = logging.getLogger(f"{__name__}.USBHubController")
 
     def connect(self) -> bool:
@@ -149,12 +227,7 @@ class USBHubController:
             self.ws_thread.start()
 
             # Wait for connection
-            for _ in range(50):  # 5 second timeout
-                if self.connected:
-                    return True
-                time.sleep(0.1)
-
-            return False
+            return self._connected_event.wait(timeout=5.0)
 
         except Exception as e:
             self.logger.error(f"Failed to connect to USBFlashHub: {e}")
@@ -169,16 +242,17 @@ class USBHubController:
     def _on_open(self, ws):
         """WebSocket connection opened"""
         self.connected = True
+        self._connected_event.set()
         self.logger.info("Connected to USBFlashHub")
 
     def _on_message(self, ws, message):
         """Handle incoming WebSocket message"""
         try:
-            # Put message in queue for processing
-            asyncio.run_coroutine_threadsafe(
-                self.response_queue.put(message),
-                asyncio.get_event_loop()
-            )
+            # Hand the message to a send_command waiting for a reply
+            data = orjson.loads(message) if ORJSON_AVAILABLE else json.loads(message)
+            self.response_queue.put_nowait(data)
+        except queue.Full:
+            pass  # Nobody is waiting for a reply
         except Exception as e:
             self.logger.error(f"Error handling message: {e}")
 
@@ -189,6 +263,7 @@ class USBHubController:
     def _on_close(self, ws, close_status_code, close_msg):
         """WebSocket connection closed"""
         self.connected = False
+        self._connected_event.clear()
         self.logger.info("Disconnected from USBFlashHub")
 
     def send_command(self, command: Dict[str, Any], wait_for_response: bool = True) -> Optional[Dict[str, Any]]:
@@ -198,21 +273,23 @@ class USBHubController:
             return None
 
         try:
-            cmd_json = json.dumps(command)
-            self.logger.debug(f"Sending command: {cmd_json}")
-            self.ws.send(cmd_json)
+            if wait_for_response:
+                # Discard broadcasts that arrived before this command
+                while not self.response_queue.empty():
+                    self.response_queue.get_nowait()
+
+            # websocket-client sends bytes in a text frame just like str
+            cmd_json = orjson.dumps(command) if ORJSON_AVAILABLE else json.dumps(command)
+            self.logger.debug("Sending command: %s", cmd_json)
+            with self._send_lock:
+                self.ws.send(cmd_json)
 
             if wait_for_response:
-                # Wait for response (simple implementation)
-                time.sleep(0.1)  # Give time for response
+                # Returns as soon as the WebSocket thread delivers the reply
                 try:
-                    response = asyncio.run_coroutine_threadsafe(
-                        asyncio.wait_for(self.response_queue.get(), timeout=5.0),
-                        asyncio.get_event_loop()
-                    ).result()
-                    return json.loads(response)
-                except (asyncio.TimeoutError, json.JSONDecodeError):
-                    pass
+                    return self.response_queue.get(timeout=RESPONSE_TIMEOUT)
+                except queue.Empty:
+                    self.logger.warning(f"No response to command: {cmd_json}")
 
             return {"status": "sent"}
 
@@ -220,16 +297,40 @@ class USBHubController:
             self.logger.error(f"Failed to send command: {e}")
             return None
 
+    def send_many(self, commands: List[Dict[str, Any]]) -> bool:
+        """Send commands back-to-back without waiting for replies in between
+
+        The firmware parses one JSON command per WebSocket frame, so each
+        command keeps its own frame; the frames just go out as one burst.
+        """
+        if not self.connected:
+            self.logger.error("Not connected to USBFlashHub")
+            return False
+
+        try:
+            dumps = orjson.dumps if ORJSON_AVAILABLE else json.dumps
+            frames = [dumps(command) for command in commands]
+            with self._send_lock:
+                for frame in frames:
+                    self.logger.debug("Sending command: %s", frame)
+                    self.ws.send(frame)
+            return True
+
+        except Exception as e:
+            self.logger.error(f"Failed to send commands: {e}")
+            return False
+
     def power_port(self, port: int, power_level: str = "high") -> bool:
         """Control power to a specific port"""
+        # The hub answers with a status broadcast nobody needs here
         command = {"cmd": "port", "port": port, "power": power_level}
-        response = self.send_command(command)
+        response = self.send_command(command, wait_for_response=False)
         return response is not None
 
     def set_boot_pin(self, state: bool) -> bool:
         """Control boot pin state"""
         command = {"cmd": "boot", "state": state}
-        response = self.send_command(command)
+        response = self.send_command(command, wait_for_response=False)
         return response is not None
 
     def set_reset_pin(self, state: bool) -> bool:
@@ -259,11 +360,11 @@ class USBHubController:
 class DeviceDetector:
     """USB device detection and monitoring using pyudev"""
 
-    # Known device types based on VID/PID
-    DEVICE_TYPES = {
+    # Known device types based on VID/PID. The original ESP32 has no native
+    # USB, so it never enumerates under Espressif's 303a vendor ID
+    _RAW_TYPES = {
         ('303a', '1001'): 'ESP32-S2',
         ('303a', '0002'): 'ESP32-S2',
-        ('303a', '1000'): 'ESP32',
         ('303a', '80d4'): 'ESP32-C3',
         ('303a', '1000'): 'ESP32-S3',
         ('0483', 'df11'): 'STM32-DFU',
@@ -274,11 +375,19 @@ class DeviceDetector:
         ('0403', '6001'): 'FTDI-Serial',
     }
 
+    # Keyed by (vid << 16) | pid so a hot-plug lookup hashes one small int
+    DEVICE_TYPES = MappingProxyType({
+        int(vid, 16) << 16 | int(pid, 16): name for (vid, pid), name in _RAW_TYPES.items()
+    })
+
     def __init__(self):
         self.context = pyudev.Context()
         self.monitor = pyudev.Monitor.from_netlink(self.context)
-        self.monitor.filter_by(subsystem='usb')
+        # Filter in the kernel socket so per-interface events never reach Python
+        self.monitor.filter_by(subsystem='usb', device_type='usb_device')
         self.devices = {}  # device_path -> DeviceInfo
+        # Notified whenever a device is added, so waiters need not poll
+        self.devices_changed = threading.Condition()
         self.port_mapping = {}  # port_number -> device_path
         self.logger = logging.getLogger(f"{__name__}.DeviceDetector")
         self.observer = None
@@ -295,8 +404,10 @@ class DeviceDetector:
         # Initial scan for existing devices
         self._scan_existing_devices()
 
-        # Start monitoring for new events
-        self.observer = pyudev.MonitorObserver(self.monitor, self._handle_device_event)
+        # Start monitoring for new events. The observer thread blocks in poll()
+        # on the monitor's socket; callbacks only queue work, so it is never held up
+        self.observer = pyudev.MonitorObserver(self.monitor, callback=self._handle_device_event,
+                                               name='udev-monitor')
         self.observer.start()
 
     def stop_monitoring(self):
@@ -312,8 +423,8 @@ class DeviceDetector:
         for device in self.context.list_devices(subsystem='usb', DEVTYPE='usb_device'):
             device_info = self._create_device_info(device)
             if device_info:
-                self.devices[device_info.device_path] = device_info
-                self.logger.info(f"Found existing device: {device_info.device_type} at {device_info.device_path}")
+                self._add_device(device_info)
+                self.logger.info("Found existing device: %s at %s", device_info.device_type, device_info.device_path)
 
                 # Notify callbacks
                 for callback in self.device_callbacks:
@@ -327,16 +438,21 @@ class DeviceDetector:
         action = device.action
 
         if action in ['add', 'remove']:
-            device_info = self._create_device_info(device)
-            if device_info:
-                if action == 'add':
-                    self.devices[device_info.device_path] = device_info
-                    self.logger.info(f"Device connected: {device_info.device_type} at {device_info.device_path}")
-                elif action == 'remove':
-                    if device_info.device_path in self.devices:
-                        del self.devices[device_info.device_path]
-                        self.logger.info(f"Device disconnected: {device_info.device_path}")
+            if action == 'add':
+                device_info = self._create_device_info(device)
+                if device_info:
+                    self._add_device(device_info)
+                    self.logger.info("Device connected: %s at %s", device_info.device_type, device_info.device_path)
+            else:
+                # Hand callbacks the recorded entry, which carries the port number;
+                # only devices never recorded need their properties parsed
+                device_info = self.devices.pop(device.device_path, None)
+                if device_info:
+                    self.logger.info("Device disconnected: %s", device_info.device_path)
+                else:
+                    device_info = self._create_device_info(device)
 
+            if device_info:
                 # Notify callbacks
                 for callback in self.device_callbacks:
                     try:
@@ -344,6 +460,12 @@ class DeviceDetector:
                     except Exception as e:
                         self.logger.error(f"Error in device callback: {e}")
 
+    def _add_device(self, device_info: DeviceInfo):
+        """Record a connected device and wake anything waiting for it"""
+        with self.devices_changed:
+            self.devices[device_info.device_path] = device_info
+            self.devices_changed.notify_all()
+
     def _create_device_info(self, device) -> Optional[DeviceInfo]:
         """Create DeviceInfo from pyudev device"""
         try:
@@ -353,7 +475,8 @@ class DeviceDetector:
             if not vendor_id or not product_id:
                 return None
 
-            device_type = self.DEVICE_TYPES.get((vendor_id, product_id), 'Unknown')
+            key = int(vendor_id, 16) << 16 | int(product_id, 16)
+            device_type = self.DEVICE_TYPES.get(key, 'Unknown')
 
             return DeviceInfo(
                 vendor_id=vendor_id,
@@ -374,7 +497,7 @@ class DeviceDetector:
         if device_path in self.devices:
             self.devices[device_path].port_number = port_number
             self.port_mapping[port_number] = device_path
-            self.logger.info(f"Correlated device {device_path} with port {port_number}")
+            self.logger.info("Correlated device %s with port %s", device_path, port_number)
 
     def get_device_by_port(self, port_number: int) -> Optional[DeviceInfo]:
         """Get device information for a specific port"""
@@ -388,6 +511,19 @@ class DeviceDetector:
         return list(self.devices.values())
 
 
+# Devices tested at once; a rack powering on gets this many workers
+MAX_CONCURRENT_DEVICES = 8
+
+# Results kept for reports; older ones only count towards the totals
+RESULT_HISTORY_SIZE = 1000
+
+# Seconds stop() gives running device tests to wind down
+SHUTDOWN_GRACE = 5.0
+
+# libyaml's C loader when PyYAML was built with it
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
 class TestingEngine:
     """Main testing engine that orchestrates device detection, rule matching, and test execution"""
 
@@ -395,10 +531,46 @@ class TestingEngine:
         self.hub_controller = USBHubController()
         self.device_detector = DeviceDetector()
         self.rules = []
-        self.test_results = []
+        # vendor ID -> [(rule position, rule)]; rules without a literal vendor ID
+        # are tried against every device
+        self._rules_by_vendor = {}
+        self._unindexed_rules = []
+        # Device fields the rules look at -> matching rules; plug-ins repeat the
+        # same few kinds of board, so most events are answered from here
+        self._filter_fields = ()
+        self._match_cache = {}
+        self.test_results = deque(maxlen=RESULT_HISTORY_SIZE)
+        self._passed_count = 0
+        self._failed_count = 0
+        self._results_lock = threading.Lock()
         self.running = False
+        self._stop_event = threading.Event()
         self.logger = logging.getLogger(f"{__name__}.TestingEngine")
 
+        # Each device is tested on its own worker. A device's rules hold its
+        # port lock; rules that touch shared hardware (boot/reset lines, port
+        # power) hold the hub lock for their whole run, so another device's
+        # reset can't land between one device's bootloader entry and its flash
+        self._executor = None
+        self._pending = set()  # futures of device tests not yet finished
+        self._processes = set()  # flashing/test tools currently running
+        self._processes_lock = threading.Lock()
+        self._port_locks = {}
+        self._port_locks_guard = threading.Lock()
+        self._hub_lock = threading.RLock()
+        self._esptool_lock = threading.Lock()
+
+        # Step action -> handler taking (step, device_info, logs)
+        self._step_handlers = {
+            "power_on": self._step_power_on,
+            "power_off": self._step_power_off,
+            "wait_for_device": self._step_wait_for_device,
+            "enter_bootloader": self._step_enter_bootloader,
+            "flash_firmware": self._flash_firmware,
+            "reset_device": self._step_reset_device,
+            "run_test": self._run_test,
+        }
+
         # Load configuration
         if config_file:
             self.load_config(config_file)
@@ -409,27 +581,96 @@ class TestingEngine:
     def load_config(self, config_file: str):
         """Load test rules from configuration file"""
         try:
-            with open(config_file, 'r') as f:
-                config = yaml.safe_load(f)
-
-            self.rules = []
-            for rule_dict in config.get('rules', []):
-                rule = DeviceRule.from_dict(rule_dict)
-                self.rules.append(rule)
+            self.rules = self._load_rules(Path(config_file))
+            for rule in self.rules:
                 self.logger.info(f"Loaded rule: {rule.name}")
+                # Report missing files once at startup rather than at each run
+                for step in rule.steps:
+                    if step.path and not step.path.is_file():
+                        self.logger.warning("Rule %s: %s file not found: %s", rule.name, step.action, step.path)
 
         except Exception as e:
             self.logger.error(f"Failed to load config from {config_file}: {e}")
 
+        self._index_rules()
+
+    def _load_rules(self, config_path: Path) -> List[DeviceRule]:
+        """Parse rules from YAML, reusing a pickled copy while the file is unchanged"""
+        cache_dir = config_path.parent / '__pycache__'
+        cache_path = cache_dir / f"{config_path.name}.rules.pickle"
+
+        # A new agent version may change DeviceRule, so it invalidates the cache too
+        config_stat = config_path.stat()
+        cache_key = (config_stat.st_mtime_ns, config_stat.st_size, Path(__file__).stat().st_mtime_ns)
+
+        try:
+            with open(cache_path, 'rb') as f:
+                cached_key, rules = pickle.load(f)
+            if cached_key == cache_key:
+                self.logger.debug("Loaded rules from cache %s", cache_path)
+                return rules
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logger.debug("Ignoring unreadable rules cache %s: %s", cache_path, e)
+
+        with open(config_path, 'r') as f:
+            config = yaml.load(f, Loader=YAML_LOADER)
+
+        rules = [DeviceRule.from_dict(rule_dict) for rule_dict in config.get('rules', [])]
+
+        try:
+            cache_dir.mkdir(exist_ok=True)
+            with open(cache_path, 'wb') as f:
+                pickle.dump((cache_key, rules), f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            self.logger.debug("Could not write rules cache %s: %s", cache_path, e)
+
+        return rules
+
+    def _index_rules(self):
+        """Bucket rules by literal vendor ID for constant-time candidate lookup"""
+        self._rules_by_vendor = {}
+        self._unindexed_rules = []
+        self._filter_fields = tuple(sorted({key for rule in self.rules for key in rule.device_filter}))
+        self._match_cache = {}
+
+        for position, rule in enumerate(self.rules):
+            if rule.vendor_key:
+                self._rules_by_vendor.setdefault(rule.vendor_key, []).append((position, rule))
+            else:
+                self._unindexed_rules.append((position, rule))
+
+    def _find_matching_rules(self, device_info: DeviceInfo) -> List[DeviceRule]:
+        """Rules that apply to a device, in configuration order"""
+        # Devices agreeing on every filtered field match the same rules
+        cache_key = tuple(getattr(device_info, name, None) for name in self._filter_fields)
+        matching_rules = self._match_cache.get(cache_key)
+        if matching_rules is not None:
+            return matching_rules
+
+        candidates = self._rules_by_vendor.get(device_info.vendor_id, [])
+        if self._unindexed_rules:
+            candidates = sorted(candidates + self._unindexed_rules, key=lambda entry: entry[0])
+
+        matching_rules = [rule for _, rule in candidates if rule.matches_device(device_info)]
+        self._match_cache[cache_key] = matching_rules
+        return matching_rules
+
     def start(self) -> bool:
         """Start the testing engine"""
         self.logger.info("Starting testing engine")
+        # Cleared first so a signal that arrives while connecting still stops the engine
+        self._stop_event.clear()
 
         # Connect to hub
         if not self.hub_controller.connect():
             self.logger.error("Failed to connect to USBFlashHub")
             return False
 
+        self._executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DEVICES,
+                                            thread_name_prefix="device-test")
+
         # Start device monitoring
         self.device_detector.start_monitoring()
 
@@ -439,33 +680,69 @@ class TestingEngine:
     def stop(self):
         """Stop the testing engine"""
         self.logger.info("Stopping testing engine")
-        self.running = False
+        self.request_stop()
 
         self.device_detector.stop_monitoring()
+        if self._executor:
+            # Drop queued devices, end running tools so their steps fail
+            # promptly, then give the tests a moment to record results
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            with self._processes_lock:
+                for proc in self._processes:
+                    proc.terminate()
+            wait(list(self._pending), timeout=SHUTDOWN_GRACE)
         self.hub_controller.disconnect()
 
+    def request_stop(self):
+        """Ask the engine to stop; safe to call from a signal handler"""
+        self.running = False
+        self._stop_event.set()
+
+    def wait_until_stopped(self, timeout: Optional[float] = None) -> bool:
+        """Block until stop() is called or timeout expires; True if stopped"""
+        return self._stop_event.wait(timeout)
+
     def _on_device_event(self, action: str, device_info: DeviceInfo):
         """Handle device connection/disconnection events"""
         if action == 'add' and self.running:
-            # Try to match device with rules and execute tests
-            self._process_new_device(device_info)
+            # Try to match device with rules and execute tests without
+            # holding up the udev thread or other devices
+            future = self._executor.submit(self._process_new_device, device_info)
+            self._pending.add(future)
+            future.add_done_callback(self._pending.discard)
+
+    def _port_lock(self, device_info: DeviceInfo) -> threading.Lock:
+        """Lock serialising work on one hub port (or one device until it is correlated)"""
+        key = device_info.port_number if device_info.port_number is not None else device_info.device_path
+        with self._port_locks_guard:
+            return self._port_locks.setdefault(key, threading.Lock())
 
     def _process_new_device(self, device_info: DeviceInfo):
         """Process a newly detected device and run applicable tests"""
-        self.logger.info(f"Processing new device: {device_info.device_type}")
+        self.logger.info("Processing new device: %s", device_info.device_type)
 
         # Find matching rules
-        matching_rules = [rule for rule in self.rules if rule.matches_device(device_info)]
+        matching_rules = self._find_matching_rules(device_info)
 
         if not matching_rules:
-            self.logger.info(f"No rules match device {device_info.device_type}")
+            self.logger.info("No rules match device %s", device_info.device_type)
             return
 
         # Execute each matching rule
-        for rule in matching_rules:
-            self.logger.info(f"Executing rule {rule.name} for device {device_info.device_type}")
-            result = self._execute_rule(rule, device_info)
+        with self._port_lock(device_info):
+            for rule in matching_rules:
+                self.logger.info("Executing rule %s for device %s", rule.name, device_info.device_type)
+                result = self._execute_rule(rule, device_info)
+                self._record_result(result)
+
+    def _record_result(self, result: TestResult):
+        """Keep a result for reports and update the running totals"""
+        with self._results_lock:
             self.test_results.append(result)
+            if result.success:
+                self._passed_count += 1
+            else:
+                self._failed_count += 1
 
     def _execute_rule(self, rule: DeviceRule, device_info: DeviceInfo) -> TestResult:
         """Execute a test rule for a specific device"""
@@ -476,17 +753,18 @@ class TestingEngine:
         error_message = None
 
         try:
-            for step in rule.steps:
-                self.logger.info(f"Executing step: {step.action}")
-                logs.append(f"Executing step: {step.action}")
+            with self._hub_lock if rule.uses_shared_hardware else nullcontext():
+                for step in rule.steps:
+                    self.logger.info("Executing step: %s", step.action)
+                    logs.append(f"Executing step: {step.action}")
 
-                step_success = self._execute_step(step, device_info, logs)
-                steps_executed.append(step.action)
+                    step_success = self._execute_step(step, device_info, logs)
+                    steps_executed.append(step.action)
 
-                if not step_success:
-                    success = False
-                    error_message = f"Step {step.action} failed"
-                    break
+                    if not step_success:
+                        success = False
+                        error_message = f"Step {step.action} failed"
+                        break
 
         except Exception as e:
             success = False
@@ -509,64 +787,63 @@ class TestingEngine:
 
         # Log result
         status = "PASSED" if success else "FAILED"
-        self.logger.info(f"Rule {rule.name} {status} for device {device_info.device_type}")
+        self.logger.info("Rule %s %s for device %s", rule.name, status, device_info.device_type)
 
         return result
 
     def _execute_step(self, step: TestStep, device_info: DeviceInfo, logs: List[str]) -> bool:
         """Execute a single test step"""
-        try:
-            action = step.action
-            params = step.params
-
-            if action == "power_on":
-                port = params.get("port", "auto")
-                if port == "auto":
-                    # Auto-detect port (simplified - would need proper correlation logic)
-                    port = 1  # Default to port 1 for now
-                power_level = params.get("power_level", "high")
-                return self.hub_controller.power_port(port, power_level)
-
-            elif action == "power_off":
-                port = params.get("port", device_info.port_number or 1)
-                return self.hub_controller.power_port(port, "off")
-
-            elif action == "wait_for_device":
-                timeout = params.get("timeout", 5)
-                return self._wait_for_device(device_info, timeout, logs)
-
-            elif action == "enter_bootloader":
-                method = params.get("method", "boot_reset")
-                return self._enter_bootloader(method, logs)
-
-            elif action == "flash_firmware":
-                return self._flash_firmware(step, device_info, logs)
-
-            elif action == "reset_device":
-                return self._reset_device(logs)
-
-            elif action == "run_test":
-                return self._run_test(step, device_info, logs)
+        handler = self._step_handlers.get(step.action)
+        if handler is None:
+            logs.append(f"Unknown action: {step.action}")
+            return False
 
-            else:
-                logs.append(f"Unknown action: {action}")
-                return False
+        try:
+            return handler(step, device_info, logs)
 
         except Exception as e:
             logs.append(f"Error executing step {step.action}: {e}")
             return False
 
+    def _step_power_on(self, step: TestStep, device_info: DeviceInfo, logs: List[str]) -> bool:
+        """Power up the device's port"""
+        port = step.params.get("port", "auto")
+        if port == "auto":
+            # Auto-detect port (simplified - would need proper correlation logic)
+            port = 1  # Default to port 1 for now
+        power_level = step.params.get("power_level", "high")
+        return self.hub_controller.power_port(port, power_level)
+
+    def _step_power_off(self, step: TestStep, device_info: DeviceInfo, logs: List[str]) -> bool:
+        """Cut power to the device's port"""
+        port = step.params.get("port", device_info.port_number or 1)
+        return self.hub_controller.power_port(port, "off")
+
+    def _step_wait_for_device(self, step: TestStep, device_info: DeviceInfo, logs: List[str]) -> bool:
+        """Wait for the device to enumerate"""
+        return self._wait_for_device(device_info, step.params.get("timeout", 5), logs)
+
+    def _step_enter_bootloader(self, step: TestStep, device_info: DeviceInfo, logs: List[str]) -> bool:
+        """Put the device into its bootloader"""
+        return self._enter_bootloader(step.params.get("method", "boot_reset"), logs)
+
+    def _step_reset_device(self, step: TestStep, device_info: DeviceInfo, logs: List[str]) -> bool:
+        """Reset the device"""
+        return self._reset_device(logs)
+
     def _wait_for_device(self, device_info: DeviceInfo, timeout: float, logs: List[str]) -> bool:
         """Wait for device to appear"""
         logs.append(f"Waiting for device {device_info.device_type} (timeout: {timeout}s)")
 
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            # Check if device is still present
-            if device_info.device_path in self.device_detector.devices:
-                logs.append("Device detected")
-                return True
-            time.sleep(0.5)
+        detector = self.device_detector
+        with detector.devices_changed:
+            # Re-checked each time the detector records a new device
+            present = detector.devices_changed.wait_for(
+                lambda: device_info.device_path in detector.devices, timeout)
+
+        if present:
+            logs.append("Device detected")
+            return True
 
         logs.append("Timeout waiting for device")
         return False
@@ -577,18 +854,22 @@ class TestingEngine:
 
         if method == "boot_reset":
             # Standard ESP32 bootloader entry
-            self.hub_controller.set_boot_pin(True)   # Boot pin HIGH
-            time.sleep(0.1)
-            self.hub_controller.pulse_reset(100)     # Pulse reset
-            time.sleep(0.5)
-            self.hub_controller.set_boot_pin(False)  # Release boot pin
+            with self._hub_lock:
+                self.hub_controller.set_boot_pin(True)   # Boot pin HIGH
+                time.sleep(0.1)
+                self.hub_controller.pulse_reset(100)     # Pulse reset
+                time.sleep(0.5)
+                self.hub_controller.set_boot_pin(False)  # Release boot pin
             logs.append("Boot/reset sequence completed")
             return True
 
         elif method == "dfu":
-            # STM32 DFU mode entry
-            self.hub_controller.set_boot_pin(True)   # Boot0 HIGH for DFU
-            self.hub_controller.pulse_reset(100)     # Reset to enter DFU
+            # STM32 DFU mode entry: Boot0 HIGH for DFU, then reset into it
+            with self._hub_lock:
+                self.hub_controller.send_many([
+                    {"cmd": "boot", "state": True},
+                    {"cmd": "reset", "pulse": 100},
+                ])
             logs.append("DFU mode entry sequence completed")
             return True
 
@@ -598,15 +879,15 @@ class TestingEngine:
 
     def _flash_firmware(self, step: TestStep, device_info: DeviceInfo, logs: List[str]) -> bool:
         """Flash firmware to device"""
-        params = step.params
-        firmware_file = params.get("file")
-        tool = params.get("tool", "auto")
+        tool = step.params.get("tool", "auto")
 
-        if not firmware_file:
+        if not step.params.get("file"):
             logs.append("No firmware file specified")
             return False
 
-        if not Path(firmware_file).exists():
+        # Re-checked here as firmware may be rebuilt or removed while running
+        firmware_file = str(step.path)
+        if not step.path.is_file():
             logs.append(f"Firmware file not found: {firmware_file}")
             return False
 
@@ -635,6 +916,39 @@ class TestingEngine:
             logs.append(f"Flashing failed: {e}")
             return False
 
+    def _run_command(self, cmd: List[str], timeout: float, label: str, logs: List[str]) -> int:
+        """Run a command, appending its output to logs line by line as it arrives
+
+        Raises subprocess.TimeoutExpired if the command is killed for running too long.
+        """
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, errors='replace', bufsize=1)
+        with self._processes_lock:
+            self._processes.add(proc)
+        timed_out = threading.Event()
+
+        def expire():
+            timed_out.set()
+            proc.kill()
+
+        watchdog = threading.Timer(timeout, expire)
+        watchdog.start()
+
+        try:
+            for line in proc.stdout:
+                logs.append(f"{label}: {line.rstrip()}")
+            returncode = proc.wait()
+        finally:
+            watchdog.cancel()
+            proc.stdout.close()
+            with self._processes_lock:
+                self._processes.discard(proc)
+
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout)
+
+        return returncode
+
     def _flash_with_esptool(self, firmware_file: str, device_info: DeviceInfo, logs: List[str]) -> bool:
         """Flash firmware using esptool"""
         # Find serial port for device (simplified)
@@ -650,18 +964,41 @@ class TestingEngine:
 
         logs.append(f"Running: {' '.join(cmd)}")
 
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-            logs.append(f"esptool stdout: {result.stdout}")
-            if result.stderr:
-                logs.append(f"esptool stderr: {result.stderr}")
+        if ESPTOOL_AVAILABLE:
+            return self._run_esptool_in_process(cmd[1:], logs)
 
-            return result.returncode == 0
+        try:
+            return self._run_command(cmd, 60, "esptool", logs) == 0
 
         except subprocess.TimeoutExpired:
             logs.append("esptool timeout")
             return False
 
+    def _run_esptool_in_process(self, argv: List[str], logs: List[str]) -> bool:
+        """Run esptool inside this interpreter, skipping a Python start-up per flash
+
+        esptool prints to the process-wide sys.stdout, so in-process runs are
+        serialised to keep each flash's output in its own log.
+        """
+        output = io.StringIO()
+        error = None
+
+        try:
+            with self._esptool_lock, redirect_stdout(output), redirect_stderr(output):
+                esptool.main(argv)
+            success = True
+        except SystemExit as e:
+            success = e.code in (None, 0)
+        except Exception as e:
+            error = e
+            success = False
+
+        logs.extend(f"esptool: {line}" for line in output.getvalue().splitlines())
+        if error:
+            logs.append(f"esptool error: {error}")
+
+        return success
+
     def _flash_with_dfu_util(self, firmware_file: str, device_info: DeviceInfo, logs: List[str]) -> bool:
         """Flash firmware using dfu-util"""
         cmd = [
@@ -673,12 +1010,7 @@ class TestingEngine:
         logs.append(f"Running: {' '.join(cmd)}")
 
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-            logs.append(f"dfu-util stdout: {result.stdout}")
-            if result.stderr:
-                logs.append(f"dfu-util stderr: {result.stderr}")
-
-            return result.returncode == 0
+            return self._run_command(cmd, 60, "dfu-util", logs) == 0
 
         except subprocess.TimeoutExpired:
             logs.append("dfu-util timeout")
@@ -687,30 +1019,24 @@ class TestingEngine:
     def _reset_device(self, logs: List[str]) -> bool:
         """Reset the device"""
         logs.append("Resetting device")
-        return self.hub_controller.pulse_reset(100)
+        with self._hub_lock:
+            return self.hub_controller.pulse_reset(100)
 
     def _run_test(self, step: TestStep, device_info: DeviceInfo, logs: List[str]) -> bool:
         """Run a test script"""
-        params = step.params
-        script = params.get("script")
-
-        if not script:
+        if not step.params.get("script"):
             logs.append("No test script specified")
             return False
 
-        if not Path(script).exists():
+        script = str(step.path)
+        if not step.path.is_file():
             logs.append(f"Test script not found: {script}")
             return False
 
         logs.append(f"Running test script: {script}")
 
         try:
-            result = subprocess.run([script], capture_output=True, text=True, timeout=step.timeout)
-            logs.append(f"Test stdout: {result.stdout}")
-            if result.stderr:
-                logs.append(f"Test stderr: {result.stderr}")
-
-            return result.returncode == 0
+            return self._run_command([script], step.timeout, "Test", logs) == 0
 
         except subprocess.TimeoutExpired:
             logs.append(f"Test script timeout after {step.timeout}s")
@@ -720,17 +1046,22 @@ class TestingEngine:
             return False
 
     def get_test_results(self) -> List[TestResult]:
-        """Get all test results"""
-        return self.test_results.copy()
+        """Get the most recent test results"""
+        # Workers append concurrently, and a deque can't be iterated while it changes
+        with self._results_lock:
+            return list(self.test_results)
 
     def generate_report(self) -> str:
         """Generate a summary report of all test results"""
-        if not self.test_results:
+        with self._results_lock:
+            results = list(self.test_results)
+            passed_tests = self._passed_count
+            failed_tests = self._failed_count
+
+        if not results:
             return "No test results available"
 
-        total_tests = len(self.test_results)
-        passed_tests = sum(1 for result in self.test_results if result.success)
-        failed_tests = total_tests - passed_tests
+        total_tests = passed_tests + failed_tests
 
         report = []
         report.append("=" * 60)
@@ -740,14 +1071,15 @@ class TestingEngine:
         report.append(f"Passed: {passed_tests}")
         report.append(f"Failed: {failed_tests}")
         report.append(f"Success Rate: {(passed_tests/total_tests)*100:.1f}%")
+        if len(results) < total_tests:
+            report.append(f"Showing the last {len(results)} results")
         report.append("")
 
-        for result in self.test_results:
+        for result in results:
             status = "PASSED" if result.success else "FAILED"
-            duration = (result.end_time - result.start_time).total_seconds()
 
             report.append(f"[{status}] {result.rule_name} - {result.device_info.device_type}")
-            report.append(f"  Duration: {duration:.2f}s")
+            report.append(f"  Duration: {result.duration:.2f}s")
             report.append(f"  Steps: {', '.join(result.steps_executed)}")
             if result.error_message:
                 report.append(f"  Error: {result.error_message}")
@@ -757,11 +1089,11 @@ class TestingEngine:
 
 
 def signal_handler(sig, frame):
-    """Handle Ctrl+C gracefully"""
-    logger.info("Received interrupt signal, shutting down...")
+    """Handle Ctrl+C and SIGTERM gracefully"""
+    logger.info("Received %s, shutting down...", signal.Signals(sig).name)
+    # Only wake the main loop; it runs the shutdown outside the handler
     if hasattr(signal_handler, 'engine'):
-        signal_handler.engine.stop()
-    sys.exit(0)
+        signal_handler.engine.request_stop()
 
 
 def main():
@@ -776,8 +1108,9 @@ def main():
 
     args = parser.parse_args()
 
-    # Set up signal handler
+    # Set up signal handlers
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
 
     # Create and start testing engine
     engine = TestingEngine(args.config)
@@ -794,17 +1127,10 @@ def main():
     logger.info("Testing engine started. Press Ctrl+C to stop.")
 
     try:
-        # Main loop - periodically generate reports
-        last_report = time.time()
-
-        while engine.running:
-            time.sleep(1)
-
-            # Generate periodic reports
-            if time.time() - last_report >= args.report_interval:
-                report = engine.generate_report()
-                logger.info(f"Periodic Report:\n{report}")
-                last_report = time.time()
+        # Main loop - sleep until the next report is due or the engine stops
+        while not engine.wait_until_stopped(args.report_interval):
+            report = engine.generate_report()
+            logger.info(f"Periodic Report:\n{report}")
 
     except KeyboardInterrupt:
         pass
@@ -6,163 +6,555 @@ Automatically detects the actual number of connected hubs/ports.
 
 import websocket
 import json
-import time
 import argparse
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+# Commands sent ahead of the hub's replies; it answers every port and hub
+# command with one status broadcast, so this bounds the unread replies
+SEND_WINDOW = 4
+REPLY_TIMEOUT = 1.0
 
-def detect_and_activate_ports(host="usbhub.local", power="high", with_leds=True):
-    """Detect connected hubs/ports and turn them on with LEDs."""
+# Longest wait for the status reply when detecting hubs
+STATUS_TIMEOUT = 1.0
 
-    try:
-        # Connect to hub
-        ws = websocket.WebSocket()
-        ws.connect(f'ws://{host}:81')
-        print(f'Connected to USBFlashHub at {host}')
+# Pre-encoded JSON commands; only the numbers (and power) vary per run
+PORT_COMMAND = '{{"cmd":"port","port":{},"power":{}}}'
+HUB_LED_COMMAND = '{{"cmd":"hub","hub":{},"led":true}}'
+
+# Up to 8 hubs of 4 ports each
+MAX_PORTS = 32
+
+# Hub layout remembered per host, so repeat runs can skip the status probe
+TOPOLOGY_CACHE = os.path.expanduser('~/.cache/usbflashhub/topology.json')
+TOPOLOGY_MAX_AGE = 300
+
+_topology_lock = threading.Lock()  # Hosts may be handled concurrently
 
-        # Request status to detect actual connected hubs
-        print('Detecting connected hubs...')
-        cmd = {'cmd': 'status'}
-        ws.send(json.dumps(cmd))
+# --daemon keeps hub connections open in a background process reached here;
+# it exits once no run has used it for DAEMON_IDLE_TIMEOUT seconds
+DAEMON_SOCKET = os.path.expanduser('~/.cache/usbflashhub/agent.sock')
+DAEMON_IDLE_TIMEOUT = 600
+DAEMON_START_ATTEMPTS = 40
 
-        # Wait for responses (first is connection confirm, second is actual status)
-        ws.settimeout(1.0)
 
-        # Skip the connection confirmation
+def parse_ports(spec):
+    """Ports named by a spec like "1,2,3" or "1-4", sorted and without duplicates.
+
+    Ranges are clipped to the ports a hub chain can have, so a spec like
+    "1-1000" costs no more than "1-32".
+    """
+    ports = set()
+    out_of_range = False
+    for part in spec.split(','):
+        if '-' in part:
+            start, end = map(int, part.split('-'))
+            ports.update(range(max(start, 1), min(end, MAX_PORTS) + 1))
+            out_of_range |= start < 1 or end > MAX_PORTS
+        else:
+            port = int(part)
+            if 1 <= port <= MAX_PORTS:
+                ports.add(port)
+            else:
+                out_of_range = True
+
+    if out_of_range:
+        print(f'Ignoring ports outside 1-{MAX_PORTS}')
+    return sorted(ports)
+
+
+def load_topology_cache():
+    """Cached hub layouts by host"""
+    try:
+        with open(TOPOLOGY_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def update_topology_cache(host, entry):
+    """Store (or with entry None, forget) a host's layout; failures just mean probing again"""
+    with _topology_lock:
+        cache = load_topology_cache()
+        if entry is None:
+            if cache.pop(host, None) is None:
+                return
+        else:
+            cache[host] = entry
         try:
-            ws.recv()  # Discard "connected" message
-        except:
+            os.makedirs(os.path.dirname(TOPOLOGY_CACHE), exist_ok=True)
+            with open(TOPOLOGY_CACHE, 'w') as f:
+                json.dump(cache, f, indent=2)
+        except OSError:
             pass
 
-        # Get the actual status
+
+def cached_topology(host):
+    """Layout detected for host within TOPOLOGY_MAX_AGE, or None."""
+    entry = load_topology_cache().get(host)
+    if entry and 0 <= time.time() - entry.get('ts', 0) < TOPOLOGY_MAX_AGE:
+        return entry
+    return None
+
+
+def build_commands(ports, hubs, power):
+    """Encoded power commands for the ports followed by LED commands for the hubs."""
+    power = json.dumps(power)  # Encoded once for every port
+    commands = [PORT_COMMAND.format(port, power) for port in ports]
+    commands += [HUB_LED_COMMAND.format(hub) for hub in hubs]
+    return commands
+
+
+def read_status(ws, timeout=STATUS_TIMEOUT):
+    """First status frame (one listing "hubs") received within timeout, or None.
+
+    Frames are taken as they arrive, so the "connected" banner and any other
+    pending broadcasts are skipped without a separate wait for each.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        ws.settimeout(remaining)
+        try:
+            frame = ws.recv()
+        except websocket.WebSocketTimeoutException:
+            return None
+        if frame.startswith('{') and '"hubs"' in frame:
+            return json.loads(frame)
+
+
+def wait_for_reply(ws):
+    """Consume one reply frame; False if none arrives in time."""
+    try:
+        ws.recv()
+        return True
+    except websocket.WebSocketTimeoutException:
+        return False
+
+
+def send_commands(ws, commands):
+    """Send commands as one burst, paced by the hub's replies.
+
+    The firmware parses a single JSON command per WebSocket frame (512 bytes
+    max), so the commands can't share a frame. Up to SEND_WINDOW go out before
+    each reply is awaited, and the remaining replies are drained at the end so
+    every command has been applied before the socket closes.
+    """
+    ws.settimeout(REPLY_TIMEOUT)
+    in_flight = 0
+    paced = True
+
+    for cmd in commands:
+        if paced and in_flight >= SEND_WINDOW:
+            if wait_for_reply(ws):
+                in_flight -= 1
+            else:
+                paced = False  # Hub isn't replying; don't stall on every command
+        ws.send(cmd)
+        in_flight += 1
+
+    while paced and in_flight and wait_for_reply(ws):
+        in_flight -= 1
+
+
+class DaemonSession:
+    """Stand-in for websocket.WebSocket that reaches the hub through the daemon.
+
+    The daemon keeps one WebSocket per hub open between runs, so a session
+    skips the TCP connect and WebSocket upgrade.
+    """
+
+    def __init__(self):
+        self.timeout = None
+        self.sock = None
+        self.reader = None
+
+    def connect(self, url):
+        self.sock = connect_daemon()
+        self.reader = self.sock.makefile('rb')
+        self._call(op='connect', url=url)
+
+    def _call(self, **request):
+        self.sock.sendall(json.dumps(request).encode() + b'\n')
+        reply = json.loads(self.reader.readline() or b'{"error": "daemon closed the session"}')
+        if 'error' in reply:
+            raise ConnectionError(reply['error'])
+        return reply
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def send(self, data):
+        self._call(op='send', data=data)
+
+    def recv(self):
+        reply = self._call(op='recv', timeout=self.timeout)
+        if reply.get('timeout'):
+            raise websocket.WebSocketTimeoutException('Connection timed out')
+        return reply['data']
+
+    def close(self):
+        if self.sock:
+            self.reader.close()
+            self.sock.close()
+            self.sock = None
+
+
+def connect_daemon():
+    """Unix socket to the background daemon, starting the daemon if needed."""
+    for attempt in range(DAEMON_START_ATTEMPTS):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(DAEMON_SOCKET)
+            return sock
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+            if attempt == 0:
+                subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve-daemon'],
+                                 stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.DEVNULL, start_new_session=True)
+            time.sleep(0.05)
+    raise ConnectionError('Could not start the hub connection daemon')
+
+
+class HubRelay:
+    """Long-lived WebSocket to one hub, used by one daemon session at a time."""
+
+    def __init__(self, url):
+        self.url = url
+        self.lock = threading.Lock()
+        self.ws = None
+        self.banner = None
+
+    def open(self):
+        """Reconnect if the hub dropped us, otherwise discard frames nobody read."""
+        if self.ws is not None:
+            try:
+                self.ws.settimeout(0.05)
+                while True:
+                    self.ws.recv()
+            except websocket.WebSocketTimeoutException:
+                return
+            except Exception:
+                self.ws.close()
+
+        self.ws = None
+        ws = websocket.WebSocket()
+        ws.connect(self.url)
+        ws.settimeout(REPLY_TIMEOUT)
+        try:
+            # Replayed to every session, which expects a fresh connection's greeting
+            self.banner = ws.recv()
+        except websocket.WebSocketTimeoutException:
+            self.banner = None
+        self.ws = ws
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    """Serve one DaemonSession: connect, then send/recv on the hub's relay."""
+
+    def handle(self):
+        relay = None
+        pending = []
+
         try:
-            response = ws.recv()
-            status = json.loads(response)
-        except Exception as e:
-            print(f'Could not get status: {e}')
-            # Fallback to trying all ports
-            status = None
-
-        active_hubs = []
-        active_ports = []
-
-        if status and 'hubs' in status:
-            # Parse the actual connected hubs from status
-            for hub in status['hubs']:
-                hub_num = hub['num']
-                active_hubs.append(hub_num)
-
-                # Get the ports for this hub
-                if 'ports' in hub:
-                    for port in hub['ports']:
-                        port_num = port['num']
-                        # Adjust for absolute port numbering
-                        absolute_port = (hub_num - 1) * 4 + port_num
-                        active_ports.append(absolute_port)
-                else:
-                    # If no port details, assume all 4 ports
-                    for i in range(4):
-                        active_ports.append((hub_num - 1) * 4 + i + 1)
-
-                hub_start = (hub_num - 1) * 4 + 1
-                hub_end = hub_num * 4
-                print(f'  Hub {hub_num} (0x{hub["addr"]:02X}): Ports {hub_start}-{hub_end} ✓')
+            for line in self.rfile:
+                request = json.loads(line)
+                op = request.get('op')
+                try:
+                    if op == 'connect' and relay is None:
+                        relay = self.server.relay_for(request['url'])
+                        relay.lock.acquire()
+                        relay.open()
+                        pending = [relay.banner] if relay.banner else []
+                        reply = {}
+                    elif op == 'send' and relay:
+                        relay.ws.send(request['data'])
+                        reply = {}
+                    elif op == 'recv' and relay:
+                        if pending:
+                            reply = {'data': pending.pop(0)}
+                        else:
+                            relay.ws.settimeout(request.get('timeout'))
+                            reply = {'data': relay.ws.recv()}
+                    else:
+                        reply = {'error': f'Unexpected request: {op}'}
+                except websocket.WebSocketTimeoutException:
+                    reply = {'timeout': True}
+                except Exception as e:
+                    reply = {'error': str(e)}
 
+                self.wfile.write(json.dumps(reply).encode() + b'\n')
+        finally:
+            if relay and relay.lock.locked():
+                relay.lock.release()
+
+
+class HubDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server holding hub connections for --daemon runs."""
+
+    daemon_threads = True
+
+    def __init__(self, path):
+        super().__init__(path, DaemonHandler)
+        self.relays = {}
+        self.relays_lock = threading.Lock()
+        self.idle = False
+
+    def relay_for(self, url):
+        with self.relays_lock:
+            return self.relays.setdefault(url, HubRelay(url))
+
+    def handle_timeout(self):
+        self.idle = True
+
+
+def serve_daemon():
+    """Run the daemon until no session has connected for DAEMON_IDLE_TIMEOUT."""
+    os.makedirs(os.path.dirname(DAEMON_SOCKET), mode=0o700, exist_ok=True)
+
+    # Leave an already running daemon alone; only clear a stale socket file
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(DAEMON_SOCKET)
+        return
+    except (FileNotFoundError, ConnectionRefusedError):
+        if os.path.exists(DAEMON_SOCKET):
+            os.unlink(DAEMON_SOCKET)
+    finally:
+        probe.close()
+
+    old_umask = os.umask(0o177)  # Socket usable by this user only
+    try:
+        server = HubDaemon(DAEMON_SOCKET)
+    finally:
+        os.umask(old_umask)
+
+    server.timeout = DAEMON_IDLE_TIMEOUT
+    try:
+        while not server.idle:
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.unlink(DAEMON_SOCKET)
+        for relay in server.relays.values():
+            if relay.ws:
+                relay.ws.close()
+
+
+def open_hub(host, via_daemon=False):
+    """Connected WebSocket to the hub, or a session on the daemon's shared one."""
+    ws = DaemonSession() if via_daemon else websocket.WebSocket()
+    ws.connect(f'ws://{host}:81')
+    return ws
+
+
+def detect_hubs(ws, host, out=print):
+    """Ask the hub for its status and return (active_hubs, active_ports).
+
+    A successful detection is cached for the host; without a status reply
+    every possible hub and port is returned.
+    """
+    # Request status to detect actual connected hubs
+    out('Detecting connected hubs...')
+    cmd = {'cmd': 'status'}
+    ws.send(json.dumps(cmd))
+
+    try:
+        status = read_status(ws)
+        if status is None:
+            out('Could not get status: no reply from hub')
+    except Exception as e:
+        out(f'Could not get status: {e}')
+        # Fallback to trying all ports
+        status = None
+
+    active_hubs = []
+    active_ports = []
+
+    if status and 'hubs' in status:
+        # Parse the actual connected hubs from status
+        for hub in status['hubs']:
+            hub_num = hub['num']
+            active_hubs.append(hub_num)
+
+            # Get the ports for this hub
+            if 'ports' in hub:
+                for port in hub['ports']:
+                    port_num = port['num']
+                    # Adjust for absolute port numbering
+                    absolute_port = (hub_num - 1) * 4 + port_num
+                    active_ports.append(absolute_port)
+            else:
+                # If no port details, assume all 4 ports
+                for i in range(4):
+                    active_ports.append((hub_num - 1) * 4 + i + 1)
+
+            hub_start = (hub_num - 1) * 4 + 1
+            hub_end = hub_num * 4
+            out(f'  Hub {hub_num} (0x{hub["addr"]:02X}): Ports {hub_start}-{hub_end} ✓')
+
+        update_topology_cache(host, {
+            'hubs': [{'num': hub['num'], 'addr': hub['addr']} for hub in status['hubs']],
+            'ports': active_ports,
+            'ts': time.time(),
+        })
+
+    else:
+        # Fallback: try all possible ports
+        out('Could not detect hubs from status, trying all possible ports...')
+        active_hubs = list(range(1, 9))
+        active_ports = list(range(1, 33))
+
+    return active_hubs, active_ports
+
+
+def detect_and_activate_ports(host="usbhub.local", power="high", with_leds=True, out=print,
+                              via_daemon=False, refresh=False):
+    """Detect connected hubs/ports and turn them on with LEDs.
+
+    Progress goes through out, so concurrent runs can collect it per hub.
+    """
+
+    try:
+        # Connect to hub
+        ws = open_hub(host, via_daemon)
+        out(f'Connected to USBFlashHub at {host}')
+
+        topology = None if refresh else cached_topology(host)
+        if topology:
+            age = time.time() - topology['ts']
+            out(f'Using hubs detected {age:.0f}s ago (--refresh to detect again)')
+            active_hubs = [hub['num'] for hub in topology['hubs']]
+            active_ports = topology['ports']
+            for hub in topology['hubs']:
+                out(f'  Hub {hub["num"]} (0x{hub["addr"]:02X}): '
+                    f'Ports {(hub["num"] - 1) * 4 + 1}-{hub["num"] * 4} ✓')
         else:
-            # Fallback: try all possible ports
-            print('Could not detect hubs from status, trying all possible ports...')
-            active_hubs = list(range(1, 9))
-            active_ports = list(range(1, 33))
+            active_hubs, active_ports = detect_hubs(ws, host, out)
 
-        print(f'\nDetected {len(active_hubs)} hub(s) with {len(active_ports)} total port(s)')
+        out(f'\nDetected {len(active_hubs)} hub(s) with {len(active_ports)} total port(s)')
 
-        # Turn on all detected ports
-        print(f'\nTurning on all ports at {power}...')
+        # Turn on all detected ports, then LEDs for all active hubs
+        send_commands(ws, build_commands(active_ports, active_hubs if with_leds else [], power))
+
+        out(f'\nTurning on all ports at {power}...')
         for port in active_ports:
-            cmd = {'cmd': 'port', 'port': port, 'power': power}
-            ws.send(json.dumps(cmd))
-            print(f'  Port {port}: ON ({power})')
-            time.sleep(0.02)  # Small delay to avoid overwhelming
+            out(f'  Port {port}: ON ({power})')
 
-        # Turn on LEDs for all active hubs
         if with_leds:
-            print('\nTurning on hub LEDs...')
+            out('\nTurning on hub LEDs...')
             for hub in active_hubs:
-                cmd = {'cmd': 'hub', 'hub': hub, 'led': True}
-                ws.send(json.dumps(cmd))
-                print(f'  Hub {hub} LED: ON')
-                time.sleep(0.02)
+                out(f'  Hub {hub} LED: ON')
 
         ws.close()
 
-        print(f'\n✓ Successfully activated {len(active_ports)} ports')
+        out(f'\n✓ Successfully activated {len(active_ports)} ports')
         if with_leds:
-            print(f'✓ LEDs enabled on {len(active_hubs)} hubs')
+            out(f'✓ LEDs enabled on {len(active_hubs)} hubs')
 
         return active_ports, active_hubs
 
     except Exception as e:
-        print(f'Error: {e}')
-        print('\nTroubleshooting:')
-        print('1. Check if hub is powered on')
-        print('2. Verify network connection')
-        print('3. Try using IP address instead of mDNS:')
-        print('   python3 turn_on_all_ports.py --host 192.168.1.100')
+        update_topology_cache(host, None)  # Detect again next time
+        out(f'Error: {e}')
+        out('\nTroubleshooting:')
+        out('1. Check if hub is powered on')
+        out('2. Verify network connection')
+        out('3. Try using IP address instead of mDNS:')
+        out('   python3 turn_on_all_ports.py --host 192.168.1.100')
         return [], []
 
 
+def activate_ports(host, ports, power="high", with_leds=True, out=print, via_daemon=False):
+    """Turn on specific ports, and the LEDs of the hubs they belong to."""
+    try:
+        ws = open_hub(host, via_daemon)
+
+        # Determine which hubs these ports belong to
+        hubs = set((p - 1) // 4 + 1 for p in ports) if with_leds else []
+        send_commands(ws, build_commands(ports, hubs, power))
+
+        for port in ports:
+            out(f'  Port {port}: {power}')
+        for hub in hubs:
+            out(f'  Hub {hub} LED: ON')
+
+        ws.close()
+        out('✓ Done')
+
+    except Exception as e:
+        out(f'Error: {e}')
+
+
+def run_for_hosts(hosts, activate):
+    """Call activate(host, out) for each hub; several hubs are handled concurrently."""
+    if len(hosts) == 1:
+        activate(hosts[0], print)
+        return
+
+    def run(host):
+        lines = []
+        activate(host, lines.append)
+        return host, lines
+
+    # Each hub's output is printed as one block when that hub finishes
+    with ThreadPoolExecutor(max_workers=len(hosts)) as pool:
+        for future in as_completed([pool.submit(run, host) for host in hosts]):
+            host, lines = future.result()
+            print(f'\n=== {host} ===')
+            print('\n'.join(lines))
+
+
 def main():
     parser = argparse.ArgumentParser(description='Turn on all USBFlashHub ports')
-    parser.add_argument('--host', default='usbhub.local',
-                       help='Hub hostname or IP (default: usbhub.local)')
+    parser.add_argument('--host', nargs='+', default=['usbhub.local'],
+                       help='Hub hostname(s) or IP(s); several hubs are switched '
+                            'concurrently (default: usbhub.local)')
     parser.add_argument('--power', choices=['off', 'low', 'high'],
                        default='high', help='Power level (default: high)')
     parser.add_argument('--no-leds', action='store_true',
                        help='Do not turn on LEDs')
     parser.add_argument('--ports', type=str,
                        help='Specific ports to turn on (e.g., "1,2,3" or "1-4")')
+    parser.add_argument('--refresh', action='store_true',
+                       help='Detect hubs again instead of using the layout '
+                            f'cached for up to {TOPOLOGY_MAX_AGE}s')
+    parser.add_argument('--daemon', action='store_true',
+                       help='Reuse hub connections kept open by a background '
+                            'process across runs (started on first use)')
+    parser.add_argument('--serve-daemon', action='store_true', help=argparse.SUPPRESS)
 
     args = parser.parse_args()
 
-    if args.ports:
-        # Parse specific ports
-        ports = []
-        for part in args.ports.split(','):
-            if '-' in part:
-                start, end = map(int, part.split('-'))
-                ports.extend(range(start, end + 1))
-            else:
-                ports.append(int(part))
+    if args.serve_daemon:
+        serve_daemon()
+        return
 
+    if args.ports:
+        ports = parse_ports(args.ports)
         print(f'Turning on specific ports: {ports}')
-        try:
-            ws = websocket.WebSocket()
-            ws.connect(f'ws://{args.host}:81')
-
-            for port in ports:
-                cmd = {'cmd': 'port', 'port': port, 'power': args.power}
-                ws.send(json.dumps(cmd))
-                print(f'  Port {port}: {args.power}')
-
-            if not args.no_leds:
-                # Determine which hubs these ports belong to
-                hubs = set((p - 1) // 4 + 1 for p in ports)
-                for hub in hubs:
-                    cmd = {'cmd': 'hub', 'hub': hub, 'led': True}
-                    ws.send(json.dumps(cmd))
-                    print(f'  Hub {hub} LED: ON')
-
-            ws.close()
-            print('✓ Done')
-
-        except Exception as e:
-            print(f'Error: {e}')
+        run_for_hosts(args.host, lambda host, out: activate_ports(
+            host, ports, power=args.power, with_leds=not args.no_leds, out=out,
+            via_daemon=args.daemon))
     else:
         # Turn on all detected ports
-        detect_and_activate_ports(
-            host=args.host,
+        run_for_hosts(args.host, lambda host, out: detect_and_activate_ports(
+            host=host,
             power=args.power,
-            with_leds=not args.no_leds
-        )
+            with_leds=not args.no_leds,
+            out=out,
+            via_daemon=args.daemon,
+            refresh=args.refresh
+        ))
 
 
 if __name__ == '__main__':
@@ -17,14 +17,18 @@ try:
     print("\nReading output for 5 seconds...")
     print("=" * 70)
 
-    start = time.time()
-    while time.time() - start < 5:
-        if ser.in_waiting:
-            data = ser.read(ser.in_waiting)
-            try:
-                print(data.decode('utf-8', errors='replace'), end='', flush=True)
-            except:
-                print(data)
+    deadline = time.monotonic() + 5
+    while (remaining := deadline - time.monotonic()) > 0:
+        # Block for the first byte, then take whatever else is already buffered
+        ser.timeout = remaining
+        data = ser.read(1)
+        if not data:
+            break
+        data += ser.read(ser.in_waiting)
+        try:
+            print(data.decode('utf-8', errors='replace'), end='', flush=True)
+        except:
+            print(data)
 
     print("\n" + "=" * 70)
     print("Done. If no output, device may be stuck in early boot or bootloop.")
@@ -13,14 +13,19 @@ ser.reset_input_buffer()
 # Send status command
 print("Sending status command...")
 ser.write(b'{"cmd":"status"}\n')
-time.sleep(0.5)
 
 # Read response
 print("\nResponse:")
 print("=" * 70)
 found_json = False
-while ser.in_waiting:
-    line = ser.readline().decode('utf-8', errors='ignore').strip()
+deadline = time.monotonic() + 2
+while not found_json and (remaining := deadline - time.monotonic()) > 0:
+    # Returns as soon as a full line arrives, instead of after a fixed sleep
+    ser.timeout = remaining
+    raw = ser.readline()
+    if not raw:
+        break
+    line = raw.decode('utf-8', errors='ignore').strip()
     if line:
         if line.startswith('{'):
             try:
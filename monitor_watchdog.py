@@ -4,10 +4,18 @@ Monitor serial output for watchdog timeout debugging.
 Logs all output and highlights warnings about loop blocking.
 """
 import serial
-import time
 import sys
+import re
 from datetime import datetime
 
+# Driver receive buffer requested where pyserial supports it (Windows only;
+# the Linux tty buffer is fixed, so there the fix is to keep reading)
+RX_BUFFER_SIZE = 65536
+
+# Matched against the raw bytes, so lines are only decoded for printing
+ALERT_PATTERN = re.compile(rb'watchdog|wdt|blocked|warning|error|panic', re.IGNORECASE)
+HEALTH_PATTERN = re.compile(rb'health:', re.IGNORECASE)
+
 def monitor_serial(port='/dev/ttyACM0', baudrate=115200):
     """Monitor serial output with timestamp logging."""
     print(f"Connecting to {port} at {baudrate} baud...")
@@ -15,24 +23,37 @@ def monitor_serial(port='/dev/ttyACM0', baudrate=115200):
     print("=" * 70)
     
     try:
-        ser = serial.Serial(port, baudrate, timeout=1)
-        time.sleep(2)  # Wait for connection
+        # Exclusive so another monitor or flasher can't steal half the output
+        ser = serial.Serial(port, baudrate, timeout=1, exclusive=True)
+        if hasattr(ser, 'set_buffer_size'):
+            ser.set_buffer_size(rx_size=RX_BUFFER_SIZE)
         
+        pending = b''
         while True:
-            if ser.in_waiting:
-                line = ser.readline().decode('utf-8', errors='ignore').strip()
-                if line:
-                    timestamp = datetime.now().strftime('%H:%M:%S.%f')[:-3]
-                    
-                    # Highlight important messages
-                    if any(kw in line.lower() for kw in ['watchdog', 'wdt', 'blocked', 'warning', 'error', 'panic']):
-                        print(f"\033[1;31m[{timestamp}] {line}\033[0m")  # Red bold
-                    elif 'health:' in line.lower():
-                        print(f"\033[1;32m[{timestamp}] {line}\033[0m")  # Green bold
-                    else:
-                        print(f"[{timestamp}] {line}")
-                    
-                    sys.stdout.flush()
+            # Block (up to the 1s timeout) for the first byte, then take
+            # everything already buffered; readline() would read byte by byte
+            data = ser.read(1)
+            if not data:
+                continue
+            pending += data + ser.read(ser.in_waiting)
+            *lines, pending = pending.split(b'\n')
+
+            for raw_line in lines:
+                raw_line = raw_line.strip()
+                if not raw_line:
+                    continue
+                line = raw_line.decode('utf-8', errors='ignore')
+                timestamp = datetime.now().strftime('%H:%M:%S.%f')[:-3]
+                
+                # Highlight important messages
+                if ALERT_PATTERN.search(raw_line):
+                    print(f"\033[1;31m[{timestamp}] {line}\033[0m")  # Red bold
+                elif HEALTH_PATTERN.search(raw_line):
+                    print(f"\033[1;32m[{timestamp}] {line}\033[0m")  # Green bold
+                else:
+                    print(f"[{timestamp}] {line}")
+            
+            sys.stdout.flush()
                     
     except KeyboardInterrupt:
         print("\n\nMonitoring stopped by user.")
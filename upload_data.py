@@ -6,6 +6,7 @@ Usage: python3 upload_data.py [port]
 
 import os
 import sys
+import json
 import subprocess
 import tempfile
 import shutil
@@ -14,6 +15,42 @@ import shutil
 BOARD = "esp32:esp32:esp32s2"  # Change this to match your board
 UPLOAD_SPEED = "921600"
 PARTITION_SCHEME = "default"  # or "minimal" for more space
+TOOL_CACHE = os.path.expanduser("~/.cache/usbflashhub/tool_paths.json")
+
+def load_tool_cache():
+    """Tool paths remembered from earlier runs"""
+    try:
+        with open(TOOL_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_tool_path(name, path):
+    """Remember where a tool was found; failures just mean searching again"""
+    cache = load_tool_cache()
+    cache[name] = path
+    try:
+        os.makedirs(os.path.dirname(TOOL_CACHE), exist_ok=True)
+        with open(TOOL_CACHE, "w") as f:
+            json.dump(cache, f, indent=2)
+    except OSError:
+        pass
+
+def find_tool(name, filenames, paths):
+    """Find the first of filenames under paths, reusing the cached location"""
+    cached = load_tool_cache().get(name)
+    if cached and os.path.isfile(cached):
+        return cached
+
+    for path in paths:
+        for root, dirs, files in os.walk(path):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]  # Skip hidden dirs
+            for filename in filenames:
+                if filename in files:
+                    found = os.path.join(root, filename)
+                    save_tool_path(name, found)
+                    return found
+    return None
 
 def find_mklittlefs():
     """Find the mklittlefs tool"""
@@ -24,11 +61,7 @@ def find_mklittlefs():
         "/usr/bin/",
     ]
 
-    for path in paths:
-        for root, dirs, files in os.walk(path):
-            if "mklittlefs" in files:
-                return os.path.join(root, "mklittlefs")
-    return None
+    return shutil.which("mklittlefs") or find_tool("mklittlefs", ["mklittlefs"], paths)
 
 def create_littlefs_image(data_dir, image_file, size="1441792"):
     """Create a LittleFS image from data directory"""
@@ -63,12 +96,8 @@ def upload_image(image_file, port):
         "/usr/bin/",
     ]
 
-    esptool = None
-    for path in esptool_paths:
-        for root, dirs, files in os.walk(path):
-            if "esptool.py" in files or "esptool" in files:
-                esptool = os.path.join(root, "esptool.py" if "esptool.py" in files else "esptool")
-                break
+    esptool = (shutil.which("esptool.py") or shutil.which("esptool")
+               or find_tool("esptool", ["esptool.py", "esptool"], esptool_paths))
 
     if not esptool:
         print("Error: esptool not found!")